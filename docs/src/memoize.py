@@ -0,0 +1,278 @@
+"""Memoization decorator with LRU and TTL eviction and cache statistics.
+
+A more capable sibling of functools.lru_cache() (see the decorators chapter):
+
+- maxsize bounds the number of cached results, evicting the least recently
+  used one (None means unbounded).
+- ttl expires cached results after that many seconds.
+- typed caches e.g. f(1) and f(1.0) separately.
+- Used on a method, every instance gets its own cache. Caches are looked up
+  by id() of the instance and dropped by weakref.finalize(), so they don't
+  keep their instances alive (as long as the cached results don't refer to
+  the instance) and work for unhashable instances and ones comparing equal.
+  Methods of instances without weak reference support (__slots__ without
+  __weakref__) aren't cached.
+- Cache access is thread-safe. As the memoized function is called outside of
+  the lock, concurrent misses for the same arguments may compute it twice.
+- cache_info() returns hit, miss, eviction and expiration counters.
+"""
+
+import collections
+import functools
+import sys
+import threading
+import time
+import weakref
+
+_kwd_mark = object()
+
+
+def _make_key(args, kwargs, typed):
+    """Return a hashable cache key for the call arguments.
+    """
+    key = args
+    if kwargs:
+        key += (_kwd_mark,) + tuple(kwargs.items())
+    if typed:
+        key += tuple(type(arg) for arg in args)
+        if kwargs:
+            key += tuple(type(value) for value in kwargs.values())
+    return key
+
+
+class _Cache:
+    """Thread-safe LRU cache with optional time-to-live and statistics.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # {key: (value, expiry time or None)}, least recently used first
+        self.data = collections.OrderedDict()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        """Return (True, value) for a cached key or (False, None) otherwise.
+        """
+        with self.lock:
+            try:
+                (value, expires) = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return (False, None)
+            if expires is not None and expires <= time.monotonic():
+                del self.data[key]
+                self.expirations += 1
+                self.misses += 1
+                return (False, None)
+            self.data.move_to_end(key)
+            self.hits += 1
+            return (True, value)
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            if self.maxsize is not None and len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def info(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'currsize': len(self.data), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+
+def _call(func, cache, typed, args, kwargs):
+    """Return the cached result of func(*args, **kwargs), calling func on a
+    cache miss.
+    """
+    key = _make_key(args, kwargs, typed)
+    (found, result) = cache.get(key)
+    if not found:
+        result = func(*args, **kwargs)
+        cache.put(key, result)
+    return result
+
+
+class Memoized:
+    """Memoizing wrapper of a function, see memoize().
+    """
+
+    def __init__(self, func, maxsize=128, ttl=None, typed=False):
+        self.__wrapped__ = func
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.typed = typed
+        self._cache = _Cache(maxsize, ttl)
+        # {id(instance): _Cache} for use as a method
+        self._instance_caches = {}
+        self._lock = threading.Lock()
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        return _call(self.__wrapped__, self._cache, self.typed, args, kwargs)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        key = id(instance)
+        cache = self._instance_caches.get(key)
+        if cache is None:
+            with self._lock:
+                cache = self._instance_caches.get(key)
+                if cache is None:
+                    try:
+                        # Drop the cache with the instance, before its id
+                        # can be reused.
+                        finalizer = weakref.finalize(
+                            instance, self._instance_caches.pop, key, None)
+                    except TypeError:
+                        # no weak references to instance: call uncached
+                        return self.__wrapped__.__get__(instance, owner)
+                    finalizer.atexit = False
+                    cache = self._instance_caches[key] = _Cache(
+                        self.maxsize, self.ttl)
+        return _BoundMemoized(self, instance, cache)
+
+    def cache_info(self):
+        """Return the cache statistics dict, summed up over all instance
+        caches for a method.
+        """
+        info = self._cache.info()
+        for cache in list(self._instance_caches.values()):
+            for (name, value) in cache.info().items():
+                if name != 'maxsize':
+                    info[name] += value
+        return info
+
+    def cache_clear(self):
+        """Clear the cache (all instance caches for a method).
+        """
+        self._cache.clear()
+        for cache in list(self._instance_caches.values()):
+            cache.clear()
+
+
+class _BoundMemoized:
+    """Memoized method bound to an instance, using the instance's cache.
+    """
+    __slots__ = ('_memoized', '_instance', '_cache')
+
+    def __init__(self, memoized, instance, cache):
+        self._memoized = memoized
+        self._instance = instance
+        self._cache = cache
+
+    def __call__(self, *args, **kwargs):
+        memoized = self._memoized
+        return _call(functools.partial(memoized.__wrapped__, self._instance),
+                     self._cache, memoized.typed, args, kwargs)
+
+    @property
+    def __wrapped__(self):
+        return self._memoized.__wrapped__
+
+    @property
+    def __doc__(self):
+        return self._memoized.__doc__
+
+    def cache_info(self):
+        """Return the statistics dict of this instance's cache.
+        """
+        return self._cache.info()
+
+    def cache_clear(self):
+        """Clear this instance's cache.
+        """
+        self._cache.clear()
+
+
+def memoize(func=None, *, maxsize=128, ttl=None, typed=False):
+    """Decorator caching the results of func by its call arguments.
+
+    Can be used both as @memoize and with arguments, e.g.
+    @memoize(maxsize=1000, ttl=60).
+    """
+    def decorate(func):
+        return Memoized(func, maxsize=maxsize, ttl=ttl, typed=typed)
+
+    if func is None:
+        # called with arguments
+        return decorate
+    else:
+        # invoked without arguments
+        return decorate(func)
+
+
+def fib(n):
+    """Return the n-th Fibonacci number (the slow, recursive way).
+    """
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+@memoize(maxsize=None)
+def memoized_fib(n):
+    """Return the n-th Fibonacci number, memoized.
+    """
+    return n if n < 2 else memoized_fib(n - 1) + memoized_fib(n - 2)
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=25,
+                        help='argument of the example Fibonacci function')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+
+    for (name, func) in [('plain', fib), ('memoized', memoized_fib)]:
+        start = time.perf_counter()
+        result = func(args.number)
+        elapsed = time.perf_counter() - start
+        print(f'{name:>8}: fib({args.number}) = {result} in {elapsed:.6f}s')
+    print(f'    {memoized_fib.cache_info()}')
+
+    class Increaser:
+        def __init__(self, increment=1):
+            self.increment = increment
+
+        @memoize(maxsize=2)
+        def inc(self, x):
+            """Return x increased by increment init argument.
+            """
+            return x + self.increment
+
+    inc = Increaser(3)
+    for x in (10, 10, 11, 12, 10):
+        inc.inc(x)
+    print(f'Increaser(3).inc: {inc.inc.cache_info()}')
+    del inc
+    print(f'Increaser.inc after deleting the instance: '
+          f'{Increaser.inc.cache_info()}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
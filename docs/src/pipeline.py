@@ -0,0 +1,363 @@
+"""Batch processing engine for the multiple_inheritance.py node graph.
+
+In multiple_inheritance.py every message travels through the graph by nested
+node.send() calls: one message at a time, with a Python call per hop, and
+long chains of nodes exceed the recursion limit. A Pipeline instead sorts the
+node graph topologically and processes the nodes one after the other, each
+on a whole batch of messages.
+
+Nodes take part in batch processing like this:
+
+- Sources: a produce(count) method returning a list of messages if present,
+  CounterSource is supported out of the box.
+- Connectors: a send_batch(batch) method taking and returning a (new) list
+  of (msg, trail) tuples if present (None for no messages). Plain Connector
+  nodes just pass messages on.
+- Sinks (consuming nodes without out_nodes): a send_batch(batch) method if
+  present, their send(msg, trail) method for every message otherwise. The
+  return value of a sink's send_batch() is ignored.
+
+Messages sent along one edge keep their order, but the interleaving at fan-in
+nodes differs from the depth-first order of the recursive send() calls.
+
+With trail_msgs='compact' message trails are Trail objects instead of tuples:
+extending a Trail costs O(1) rather than copying the whole tuple at every hop,
+which matters for deep graphs. As Trail supports trail + (name,), nodes
+written for tuple trails work unchanged. The Pipeline extends the trails of
+plain Connector nodes without even creating Trail objects.
+"""
+
+import collections
+import sys
+import time
+
+from multiple_inheritance import (
+    ConsumingNode, Connector, CounterSource, PrinterSink, ProducingNode)
+
+
+class CountingSink(ConsumingNode):
+    """Consume and count incoming data messages.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.count = 0
+
+    def send(self, msg, trail=None):
+        self.count += 1
+
+    def send_batch(self, batch):
+        self.count += len(batch)
+
+
+class Trail:
+    """Message trail as a linked list of node names.
+
+    The list is a chain of (name, parent link) tuples, newest name first, so
+    extending a trail creates one small tuple instead of copying all names.
+    Trails iterate, compare and print like the equivalent tuple of names,
+    expand() returns that tuple.
+    """
+    __slots__ = ('link',)
+
+    def __init__(self, link):
+        self.link = link
+
+    @classmethod
+    def start(cls, name):
+        """Return a new trail starting at node name.
+        """
+        return cls((name, None))
+
+    def __add__(self, names):
+        if not isinstance(names, tuple):
+            return NotImplemented
+        link = self.link
+        for name in names:
+            link = (name, link)
+        return Trail(link)
+
+    def expand(self):
+        """Return the trail as a tuple of node names.
+        """
+        names = []
+        link = self.link
+        while link is not None:
+            (name, link) = link
+            names.append(name)
+        names.reverse()
+        return tuple(names)
+
+    def __iter__(self):
+        return iter(self.expand())
+
+    def __len__(self):
+        return len(self.expand())
+
+    def __eq__(self, other):
+        if isinstance(other, Trail):
+            other = other.expand()
+        if isinstance(other, tuple):
+            return self.expand() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.expand())
+
+    def __repr__(self):
+        return repr(self.expand())
+
+
+def start_trail(name, trail_msgs):
+    """Return the initial trail of a message from source name: None if
+    trail_msgs is false, a Trail for 'compact' and a tuple otherwise.
+    """
+    if not trail_msgs:
+        return None
+    if trail_msgs == 'compact':
+        return Trail.start(name)
+    return (name,)
+
+
+def trigger(source, trail_msgs=False):
+    """Like source.trigger(), with trail_msgs='compact' support.
+    """
+    trail = start_trail(source.name, trail_msgs)
+    for node in source.out_nodes:
+        node.send(source.count, trail=trail)
+    source.count += 1
+
+
+def topological_order(sources):
+    """Return the list of all nodes reachable from the sources, each node
+    sorted after all nodes sending to it.
+
+    Raises ValueError if the graph has a cycle.
+    """
+    # Collect the graph and count the incoming edges of every node.
+    in_degree = collections.Counter()
+    nodes = list(sources)
+    seen = set(map(id, nodes))
+    todo = list(nodes)
+    while todo:
+        node = todo.pop()
+        for out_node in getattr(node, 'out_nodes', ()):
+            in_degree[id(out_node)] += 1
+            if id(out_node) not in seen:
+                seen.add(id(out_node))
+                nodes.append(out_node)
+                todo.append(out_node)
+
+    # Kahn's algorithm
+    order = []
+    ready = collections.deque(
+        node for node in nodes if not in_degree[id(node)])
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for out_node in getattr(node, 'out_nodes', ()):
+            in_degree[id(out_node)] -= 1
+            if not in_degree[id(out_node)]:
+                ready.append(out_node)
+    if len(order) != len(nodes):
+        raise ValueError('The node graph has a cycle')
+    return order
+
+
+def produce(source, count):
+    """Return a list of the next count messages of source.
+    """
+    if hasattr(source, 'produce'):
+        return source.produce(count)
+    if isinstance(source, CounterSource):
+        msgs = range(source.count, source.count + count)
+        source.count += count
+        return list(msgs)
+    raise TypeError(f'Source {source.name!r} of type '
+                    f'{type(source).__name__} does not support batches')
+
+
+def process(node, batch, trail_msgs=True):
+    """Let node process the batch of (msg, trail) tuples, return the list of
+    (msg, trail) tuples to pass on to its out_nodes (empty for sinks).
+
+    For trail_msgs='compact' the batches hold the plain links of Trail
+    objects, which only get wrapped into Trail objects for the nodes.
+    """
+    compact = trail_msgs == 'compact'
+    if not hasattr(node, 'send_batch') and type(node).send is Connector.send:
+        if not trail_msgs:
+            # Nothing to add, pass the batch on as is.
+            return batch
+        if compact:
+            name = node.name
+            return [(msg, (name, link)) for (msg, link) in batch]
+        name = (node.name,)
+        return [(msg, None if trail is None else trail + name)
+                for (msg, trail) in batch]
+    if compact:
+        batch = [(msg, Trail(link)) for (msg, link) in batch]
+    if hasattr(node, 'send_batch'):
+        out_batch = node.send_batch(batch)
+        if not out_batch or not hasattr(node, 'out_nodes'):
+            # e.g. a sink returning the batch it consumed
+            return []
+        if compact:
+            out_batch = [(msg, trail.link) for (msg, trail) in out_batch]
+        return out_batch
+    if not isinstance(node, ProducingNode):
+        send = node.send
+        for (msg, trail) in batch:
+            send(msg, trail=trail)
+        return []
+    raise TypeError(f'Node {node.name!r} of type {type(node).__name__} '
+                    f'does not support batches')
+
+
+class Pipeline:
+    """Batch processing engine for the node graph reachable from sources.
+    """
+
+    def __init__(self, sources, batch_size=1000):
+        self.sources = list(sources)
+        self.batch_size = batch_size
+        self.nodes = topological_order(self.sources)
+
+    def run(self, count, trail_msgs=False):
+        """Produce count messages per source and process them through the
+        graph, batch_size messages at a time.
+
+        trail_msgs is False, True (tuple trails) or 'compact' (Trail trails).
+        """
+        while count > 0:
+            size = min(count, self.batch_size)
+            self.run_batch(size, trail_msgs)
+            count -= size
+
+    def run_batch(self, count, trail_msgs=False):
+        """Produce one batch of count messages per source and process it.
+        """
+        inboxes = {}
+        for source in self.sources:
+            trail = start_trail(source.name, trail_msgs)
+            if trail_msgs == 'compact':
+                trail = trail.link
+            batch = [(msg, trail) for msg in produce(source, count)]
+            for out_node in source.out_nodes:
+                inboxes.setdefault(id(out_node), []).extend(batch)
+        for node in self.nodes:
+            batch = inboxes.pop(id(node), None)
+            if not batch:
+                continue
+            out_batch = process(node, batch, trail_msgs)
+            if out_batch:
+                out_nodes = node.out_nodes
+                for out_node in out_nodes:
+                    inbox = inboxes.get(id(out_node))
+                    if inbox is not None:
+                        inbox.extend(out_batch)
+                    elif len(out_nodes) == 1:
+                        # Hand the batch over without copying it.
+                        inboxes[id(out_node)] = out_batch
+                    else:
+                        inboxes[id(out_node)] = list(out_batch)
+
+
+def example_graph(sink):
+    """Return the source of the multiple_inheritance.py example graph
+
+                  /--> B \\
+    Source --> A <        >--> sink
+                  \\--> C /
+    """
+    source = CounterSource('Source')
+    node_a = Connector('A')
+    node_b = Connector('B')
+    node_c = Connector('C')
+    source.add_out_nodes([node_a])
+    node_a.add_out_nodes([node_b, node_c])
+    node_b.add_out_nodes([sink])
+    node_c.add_out_nodes([sink])
+    return source
+
+
+def chain_graph(sink, length):
+    """Return the source of a chain of length connectors ending in sink.
+    """
+    source = CounterSource('Source')
+    node = source
+    for i in range(length):
+        connector = Connector(f'C{i}')
+        node.add_out_nodes([connector])
+        node = connector
+    node.add_out_nodes([sink])
+    return source
+
+
+def benchmark(count=100_000, batch_size=1000, chain_length=100):
+    """Print the throughput (messages per second arriving at the sink) of
+    recursive CounterSource.trigger() calls and of a Pipeline.
+    """
+    graphs = [('fan-out/fan-in', lambda sink: example_graph(sink)),
+              (f'chain of {chain_length}',
+               lambda sink: chain_graph(sink, chain_length))]
+    for (graph_name, make_graph) in graphs:
+        for trail_msgs in (False, True, 'compact'):
+            sink = CountingSink('Sink')
+            source = make_graph(sink)
+            start = time.perf_counter()
+            try:
+                for _ in range(count):
+                    trigger(source, trail_msgs=trail_msgs)
+            except RecursionError:
+                print(f'{graph_name:>16} recursive: RecursionError')
+            else:
+                elapsed = time.perf_counter() - start
+                print(f'{graph_name:>16} recursive trail={trail_msgs!s:7}: '
+                      f'{sink.count / elapsed:12.0f} msgs/s')
+
+            sink = CountingSink('Sink')
+            pipeline = Pipeline([make_graph(sink)], batch_size=batch_size)
+            start = time.perf_counter()
+            pipeline.run(count, trail_msgs=trail_msgs)
+            elapsed = time.perf_counter() - start
+            print(f'{graph_name:>16} pipeline  trail={trail_msgs!s:7}: '
+                  f'{sink.count / elapsed:12.0f} msgs/s')
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare throughput with recursive send() calls')
+    parser.add_argument('--count', type=int, default=100_000,
+                        help='number of messages per benchmark run')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='number of messages processed at a time')
+    parser.add_argument('--chain_length', type=int, default=100,
+                        help='number of connectors in the benchmark chain')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark(args.count, args.batch_size, args.chain_length)
+        return
+
+    pipeline = Pipeline([example_graph(PrinterSink('Sink'))])
+    pipeline.run(3, trail_msgs=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
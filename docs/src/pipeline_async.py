@@ -0,0 +1,187 @@
+"""Asyncio runtime for the node graph.
+
+ConsumingNode.send() and CounterSource.trigger() of multiple_inheritance.py
+are synchronous, so a sink waiting for I/O (network, disk) blocks the source.
+The async counterparts here have an async send(msg, trail), sources are
+async generators, and run() drives them on an event loop: every message is
+processed in its own task, so thousands of messages can wait for I/O at the
+same time on a single thread.
+
+- Async nodes can send to both async and plain (synchronous) nodes.
+- A Limited stand-in node limits the number of messages a node processes
+  concurrently.
+- run() limits the total number of messages in flight, to bound memory.
+"""
+
+import asyncio
+import inspect
+import sys
+import time
+
+from multiple_inheritance import ConsumingNode, ProducingNode
+
+
+async def deliver(node, msg, trail=None):
+    """Send msg to node, awaiting the result for async nodes.
+    """
+    result = node.send(msg, trail=trail)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def deliver_all(nodes, msg, trail=None):
+    """Send msg to all nodes concurrently.
+    """
+    if len(nodes) == 1:
+        await deliver(nodes[0], msg, trail)
+    else:
+        await asyncio.gather(*(deliver(node, msg, trail) for node in nodes))
+
+
+class AsyncConnector(ProducingNode, ConsumingNode):
+    """Async interconnector node, both consumes (receives) and produces (sends)
+    data.
+    """
+
+    async def send(self, msg, trail=None):
+        """Send a data message to this object, which will get passed on to all
+        connected consumer nodes.
+        """
+        trail = None if trail is None else trail + (self.name,)
+        await deliver_all(self.out_nodes, msg, trail)
+
+
+class AsyncCounterSource(ProducingNode):
+    """Produce counter data messages asynchronously.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.count = 0
+
+    async def messages(self, count):
+        """Async generator yielding the next count counter messages.
+        """
+        for _ in range(count):
+            yield self.count
+            self.count += 1
+
+
+class AsyncPrinterSink(ConsumingNode):
+    """Consume and print incoming data messages, after waiting delay seconds
+    (standing in for some I/O).
+    """
+
+    def __init__(self, name, delay=0, quiet=False):
+        super().__init__(name)
+        self.delay = delay
+        self.quiet = quiet
+        self.count = 0
+
+    async def send(self, msg, trail=None):
+        await asyncio.sleep(self.delay)
+        self.count += 1
+        if not self.quiet:
+            trail = None if trail is None else trail + (self.name,)
+            print(f'{self.__class__.__name__} "{self.name}": msg={msg} '
+                  f'trail={trail or ()}')
+
+
+class Limited(ConsumingNode):
+    """Stand-in for node, letting it process at most concurrency messages at
+    the same time. Transparent for the message trail.
+    """
+
+    def __init__(self, node, concurrency):
+        super().__init__(node.name)
+        self.node = node
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(self, msg, trail=None):
+        async with self._semaphore:
+            await deliver(self.node, msg, trail)
+
+
+async def run(source, messages, max_in_flight=10_000, trail_msgs=False):
+    """Process the messages (an async iterable) of source through the graph,
+    every message in its own task, at most max_in_flight at a time.
+
+    After a task failed no more messages are taken from messages, and the
+    first exception is raised once the running tasks are done.
+    """
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+    errors = []
+    trail = (source.name,) if trail_msgs else None
+
+    def done(task):
+        tasks.discard(task)
+        in_flight.release()
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())
+
+    async for msg in messages:
+        await in_flight.acquire()
+        if errors:
+            break
+        task = asyncio.create_task(deliver_all(source.out_nodes, msg, trail))
+        tasks.add(task)
+        task.add_done_callback(done)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if errors:
+        raise errors[0]
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=10_000,
+                        help='number of messages to produce')
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='seconds of (simulated) I/O per sink message')
+    parser.add_argument('--concurrency', type=int, default=1000,
+                        help='concurrent messages per sink')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+
+    def make_graph(sink):
+        source = AsyncCounterSource('Source')
+        node_a = AsyncConnector('A')
+        node_b = AsyncConnector('B')
+        node_c = AsyncConnector('C')
+        source.add_out_nodes([node_a])
+        node_a.add_out_nodes([node_b, node_c])
+        node_b.add_out_nodes([sink])
+        node_c.add_out_nodes([sink])
+        return source
+
+    async def example():
+        source = make_graph(AsyncPrinterSink('Sink'))
+        await run(source, source.messages(3), trail_msgs=True)
+
+        sink = AsyncPrinterSink('Sink', delay=args.delay, quiet=True)
+        source = make_graph(Limited(sink, args.concurrency))
+        start = time.perf_counter()
+        await run(source, source.messages(args.count))
+        elapsed = time.perf_counter() - start
+        print(f'{sink.count} messages with {args.delay}s I/O each in '
+              f'{elapsed:.3f}s = {sink.count / elapsed:.0f} msgs/s')
+
+    asyncio.run(example())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Checkpoints of the node graph's state, for fast restarts.
+
+CounterSource keeps its count in memory only, so after a crash the graph has
+to start all over again. A Checkpointer periodically appends the counts of
+the sources and the state of the other nodes to a checkpoint log file.
+restore() sets them back from the last checkpoint, and the sources replay
+the messages sent since then (at-least-once delivery), so a restart only
+repeats the work of one checkpoint interval.
+
+Nodes take part like this:
+
+- CounterSource: its count, out of the box.
+- Other nodes: a get_state() method returning their state (JSON
+  serializable) and a set_state(state) method restoring it, if present.
+
+Checkpoint log lines are '<crc32> <json>' records. A record torn by a crash
+fails its checksum and is skipped, restore() uses the last intact one and
+only reads the end of the file. The log gets compacted to the last record
+when it grows beyond max_bytes.
+
+The fsync policy trades durability for speed: 'always' fsyncs every
+checkpoint, 'interval' at most every fsync_interval seconds and 'never'
+leaves writing to the operating system.
+"""
+
+import json
+import os
+import sys
+import time
+import zlib
+
+from multiple_inheritance import ConsumingNode, CounterSource
+from pipeline import chain_graph, topological_order
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+def _encode(record):
+    data = json.dumps(record, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(data), data)
+
+
+def _decode(line):
+    """Return the record of line, None if it is torn or corrupted.
+    """
+    (crc, _, data) = line.rstrip(b'\n').partition(b' ')
+    try:
+        if int(crc, 16) != zlib.crc32(data):
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+class CheckpointLog:
+    """Append-only log file of checkpoint records.
+    """
+
+    def __init__(self, path, fsync='interval', fsync_interval=1.0,
+                 max_bytes=1 << 20):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy {fsync!r}, '
+                             f'use one of {FSYNC_POLICIES}')
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self._fp = open(path, 'ab')
+        if self._fp.tell():
+            with open(path, 'rb') as fp:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    # Terminate a record torn by a crash, so that it doesn't
+                    # corrupt the next one.
+                    self._fp.write(b'\n')
+        self._synced = time.monotonic()
+
+    def append(self, record):
+        """Append record (a JSON serializable dict) to the log.
+        """
+        self._fp.write(_encode(record))
+        self._fp.flush()
+        if self.fsync == 'always' or (
+                self.fsync == 'interval'
+                and time.monotonic() - self._synced >= self.fsync_interval):
+            os.fsync(self._fp.fileno())
+            self._synced = time.monotonic()
+        if self._fp.tell() > self.max_bytes:
+            self.compact(record)
+
+    def compact(self, record):
+        """Replace the log by one containing record only.
+        """
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(_encode(record))
+            fp.flush()
+            if self.fsync != 'never':
+                os.fsync(fp.fileno())
+        self._fp.close()
+        os.replace(tmp_path, self.path)
+        self._fp = open(self.path, 'ab')
+
+    def last(self, block_size=1 << 16):
+        """Return the last intact record of the log, None if there is none.
+
+        Reads the log backwards block by block, so this takes about the same
+        time however long the log is.
+        """
+        self._fp.flush()
+        with open(self.path, 'rb') as fp:
+            end = fp.seek(0, os.SEEK_END)
+            tail = b''
+            while end > 0:
+                start = max(end - block_size, 0)
+                fp.seek(start)
+                tail = fp.read(end - start) + tail
+                end = start
+                lines = tail.split(b'\n')
+                # The first line may be incomplete unless at the file start.
+                tail = lines.pop(0) if start else b''
+                for line in reversed(lines):
+                    if line and (record := _decode(line)) is not None:
+                        return record
+        return None
+
+    def close(self):
+        if self.fsync != 'never':
+            os.fsync(self._fp.fileno())
+        self._fp.close()
+
+
+class Checkpointer:
+    """Checkpoint the state of the node graph reachable from sources.
+
+    Nodes are identified by name, so names must be unique within the graph.
+    """
+
+    def __init__(self, sources, path, every=1000, **log_options):
+        self.sources = list(sources)
+        self.every = every
+        self.log = CheckpointLog(path, **log_options)
+        source_ids = set(map(id, self.sources))
+        self.nodes = [node for node in topological_order(self.sources)
+                      if hasattr(node, 'get_state')
+                      and id(node) not in source_ids]
+        self.checkpoints = 0
+        self._ticks = 0
+
+    def tick(self):
+        """Count one trigger of the sources, checkpoint every every ticks.
+        """
+        self._ticks += 1
+        if self._ticks >= self.every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Append the current state of the graph to the checkpoint log.
+        """
+        self.checkpoints += 1
+        self.log.append({
+            'checkpoint': self.checkpoints,
+            'sources': {source.name: source_state(source)
+                        for source in self.sources},
+            'nodes': {node.name: node.get_state() for node in self.nodes},
+            })
+        self._ticks = 0
+
+    def restore(self):
+        """Restore the state of the graph from the last checkpoint, return the
+        checkpoint record (None if there was no checkpoint).
+        """
+        record = self.log.last()
+        if record is None:
+            return None
+        self.checkpoints = record['checkpoint']
+        for source in self.sources:
+            if source.name in record['sources']:
+                set_source_state(source, record['sources'][source.name])
+        for node in self.nodes:
+            if node.name in record['nodes']:
+                node.set_state(record['nodes'][node.name])
+        return record
+
+    def close(self):
+        """Write a final checkpoint and close the log.
+        """
+        self.checkpoint()
+        self.log.close()
+
+
+def source_state(source):
+    """Return the state of source.
+    """
+    if hasattr(source, 'get_state'):
+        return source.get_state()
+    if isinstance(source, CounterSource):
+        return source.count
+    raise TypeError(f'Source {source.name!r} of type '
+                    f'{type(source).__name__} does not support checkpoints')
+
+
+def set_source_state(source, state):
+    """Restore the state of source.
+    """
+    if hasattr(source, 'set_state'):
+        source.set_state(state)
+    elif isinstance(source, CounterSource):
+        source.count = state
+    else:
+        raise TypeError(f'Source {source.name!r} of type '
+                        f'{type(source).__name__} does not support '
+                        f'checkpoints')
+
+
+class SummingSink(ConsumingNode):
+    """Consume, count and sum up incoming data messages, with checkpoint
+    support.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.count = 0
+        self.total = 0
+
+    def send(self, msg, trail=None):
+        self.count += 1
+        self.total += msg
+
+    def get_state(self):
+        return {'count': self.count, 'total': self.total}
+
+    def set_state(self, state):
+        self.count = state['count']
+        self.total = state['total']
+
+
+def benchmark(path, count=100_000, every=1000):
+    """Print the throughput with checkpoints for the fsync policies and the
+    restore time for growing checkpoint logs.
+    """
+    for fsync in (None,) + FSYNC_POLICIES:
+        sink = SummingSink('Sink')
+        source = chain_graph(sink, 10)
+        if fsync:
+            checkpointer = Checkpointer([source], path, every=every,
+                                        fsync=fsync, max_bytes=1 << 30)
+        start = time.perf_counter()
+        for _ in range(count):
+            source.trigger()
+            if fsync:
+                checkpointer.tick()
+        elapsed = time.perf_counter() - start
+        if fsync:
+            checkpointer.close()
+            os.remove(path)
+        print(f'fsync={fsync!s:8}: {count / elapsed:10.0f} msgs/s')
+
+    checkpointer = Checkpointer([chain_graph(SummingSink('Sink'), 10)], path,
+                                fsync='never', max_bytes=1 << 30)
+    for checkpoints in (10, 1000, 100_000):
+        while checkpointer.checkpoints < checkpoints:
+            checkpointer.checkpoint()
+        start = time.perf_counter()
+        checkpointer.restore()
+        elapsed = time.perf_counter() - start
+        print(f'restore from a log of {checkpoints:6} checkpoints '
+              f'({os.path.getsize(path):9} bytes): {elapsed * 1000:.3f}ms')
+    checkpointer.log.close()
+    os.remove(path)
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='checkpoint log file')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure checkpoint overhead and restore time')
+    parser.add_argument('--count', type=int, default=2500,
+                        help='number of messages to produce')
+    parser.add_argument('--every', type=int, default=1000,
+                        help='number of messages per checkpoint')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES,
+                        default='interval', help='fsync policy')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark(args.path, args.count, args.every)
+        return
+
+    # Run the graph as a process would, which gets killed without final
+    # checkpoint after args.count messages.
+    sink = SummingSink('Sink')
+    source = chain_graph(sink, 3)
+    checkpointer = Checkpointer([source], args.path, every=args.every,
+                                fsync=args.fsync)
+    record = checkpointer.restore()
+    print(f'restored {record}')
+    for _ in range(args.count):
+        source.trigger()
+        checkpointer.tick()
+    print(f'stopped at count={source.count} sink={sink.get_state()}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
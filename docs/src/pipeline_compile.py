@@ -0,0 +1,148 @@
+"""Compile the node graph by fusing chains of pass-through connectors.
+
+A plain Connector of multiple_inheritance.py just adds its name to the trail
+and passes every message on to its out_nodes, yet it costs a Python call and
+a loop over out_nodes per message. compile_graph() replaces every plain
+Connector in the out_nodes of the remaining producing nodes (sources and
+connectors with their own send()) with a FusedNode stand-in. It holds the
+precomputed, flattened list of the nodes the connector's subgraph finally
+delivers to, together with the names to add to the trail on the way, so the
+cost per message no longer grows with the length of connector chains.
+
+Messages arrive in the same depth-first order and with the same trails as
+before. The graph is compiled in place, later changes to out_nodes of the
+fused connectors are not taken into account.
+"""
+
+import sys
+import time
+
+from multiple_inheritance import ConsumingNode, Connector, PrinterSink
+from pipeline import (
+    CountingSink, chain_graph, example_graph, topological_order, trigger)
+
+
+def is_pass_through(node):
+    """Return True if node is a Connector with the plain Connector.send().
+    """
+    return isinstance(node, Connector) and type(node).send is Connector.send
+
+
+def flatten(node):
+    """Return the list of (target node, trail names) tuples a message sent to
+    pass-through node ends up with, in depth-first order.
+    """
+    targets = []
+    todo = [(node, ())]
+    while todo:
+        (node, names) = todo.pop()
+        if is_pass_through(node):
+            names += (node.name,)
+            todo.extend((out_node, names)
+                        for out_node in reversed(node.out_nodes))
+        else:
+            targets.append((node, names))
+    return targets
+
+
+class FusedNode(ConsumingNode):
+    """Stand-in for a pass-through connector, sending messages directly to
+    the nodes at the end of its (fused) subgraph.
+    """
+
+    def __init__(self, node):
+        super().__init__(node.name)
+        self.node = node
+        self.targets = flatten(node)
+        self._sends = [target.send for (target, _) in self.targets]
+
+    def send(self, msg, trail=None):
+        if trail is None:
+            for send in self._sends:
+                send(msg, trail=None)
+        else:
+            for (target, names) in self.targets:
+                target.send(msg, trail=trail + names)
+
+
+def compile_graph(sources):
+    """Compile the node graph reachable from sources in place, return the
+    number of fused connectors.
+
+    Raises ValueError if the graph has a cycle.
+    """
+    nodes = topological_order(sources)
+    fused = {id(node) for node in nodes if is_pass_through(node)}
+    for node in nodes:
+        if id(node) in fused or not hasattr(node, 'out_nodes'):
+            continue
+        node.out_nodes = [
+            FusedNode(out_node) if id(out_node) in fused else out_node
+            for out_node in node.out_nodes]
+    return len(fused)
+
+
+def benchmark(count=100_000, chain_length=100):
+    """Print the throughput (messages per second arriving at the sink) of
+    recursive trigger() calls before and after compiling the graph.
+    """
+    graphs = [('fan-out/fan-in', lambda sink: example_graph(sink)),
+              (f'chain of {chain_length}',
+               lambda sink: chain_graph(sink, chain_length))]
+    for (graph_name, make_graph) in graphs:
+        for trail_msgs in (False, True):
+            for compiled in (False, True):
+                sink = CountingSink('Sink')
+                source = make_graph(sink)
+                if compiled:
+                    compile_graph([source])
+                start = time.perf_counter()
+                try:
+                    for _ in range(count):
+                        trigger(source, trail_msgs=trail_msgs)
+                except RecursionError:
+                    print(f'{graph_name:>16} trail={trail_msgs!s:5} '
+                          f'compiled={compiled!s:5}: RecursionError')
+                    continue
+                elapsed = time.perf_counter() - start
+                print(f'{graph_name:>16} trail={trail_msgs!s:5} '
+                      f'compiled={compiled!s:5}: '
+                      f'{sink.count / elapsed:10.0f} msgs/s')
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare throughput with the uncompiled graph')
+    parser.add_argument('--count', type=int, default=100_000,
+                        help='number of messages per benchmark run')
+    parser.add_argument('--chain_length', type=int, default=100,
+                        help='number of connectors in the benchmark chain')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark(args.count, args.chain_length)
+        return
+
+    source = example_graph(PrinterSink('Sink'))
+    print(f'fused {compile_graph([source])} connectors')
+    for _ in range(3):
+        source.trigger(trail_msgs=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
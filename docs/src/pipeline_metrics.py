@@ -0,0 +1,474 @@
+"""Metrics for the node graph, to find its slow nodes.
+
+instrument() puts a MeteredNode stand-in in front of every consuming node
+reachable from the sources. It counts the node's messages and errors (raised
+exceptions) and records its processing latency: the time spent in the node's
+send() itself, without the time its out_nodes took. For QueuedNode
+connections (see pipeline_queues.py) the time messages waited in the buffer
+is reported as well.
+
+Measuring latency costs two clock reads per node and message. With
+sample_every=n only every n-th message (per entry node) gets timed, on its
+whole way through the graph. Messages and errors are counted for all messages,
+by stand-ins doing nothing else. The timing stand-ins (see TimedNode) are
+switched into the graph in their place just while a sampled message is on its
+way. Errors are counted for the node raising them only.
+
+GraphMetrics.snapshot() returns all metrics as a dict,
+GraphMetrics.write_prometheus() writes them to a file in the Prometheus text
+format, e.g. for the textfile collector of the Prometheus node exporter.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+from multiple_inheritance import ConsumingNode, Connector, CounterSource
+from pipeline import CountingSink, chain_graph, trigger
+from pipeline_queues import QueuedNode, SlowSink, connect
+from tracing import LatencyHistogram
+
+PREFIX = 'cpycourse'
+QUANTILES = (50, 90, 99)
+# Number of timed samples of a node to collect before adding them up.
+_DRAIN_AT = 4096
+
+_clock = time.perf_counter_ns
+
+
+class NodeStats:
+    """Message and error count and latency histogram of a node.
+
+    The counts are incremented without a lock, so concurrent senders to a
+    node may (rarely) lose one.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.errors = 0
+        self.sampled = 0
+        self.self_ns = 0
+        self.total_ns = 0
+        self.histogram = LatencyHistogram()
+        self.lock = threading.Lock()
+        # (self ns, total ns) of timed messages not yet added up, appended
+        # without taking the lock
+        self.samples = collections.deque()
+
+    def drain(self):
+        """Add up the collected samples.
+        """
+        samples = self.samples
+        # Only the samples there now, popleft() is safe against concurrent
+        # append().
+        batch = [samples.popleft() for _ in range(len(samples))]
+        if not batch:
+            return
+        owns = [own for (own, _) in batch]
+        with self.lock:
+            self.sampled += len(batch)
+            self.self_ns += sum(owns)
+            self.total_ns += sum(elapsed for (_, elapsed) in batch)
+            self.histogram.record_many(owns)
+
+    def as_dict(self):
+        self.drain()
+        with self.lock:
+            histogram = self.histogram
+            return {
+                'messages': self.messages,
+                'errors': self.errors,
+                'sampled': self.sampled,
+                'self_ns': self.self_ns,
+                'total_ns': self.total_ns,
+                'mean_ns': self.self_ns / self.sampled if self.sampled else 0,
+                **{f'p{q}_ns': histogram.percentile(q) for q in QUANTILES},
+                'max_ns': histogram.max,
+                }
+
+
+class _State(threading.local):
+    """State of the current thread's message processing.
+    """
+
+    def __init__(self):
+        # whether the message being processed is timed
+        self.sampling = False
+        # time spent in out_nodes, per metered send() call being timed
+        self.children = []
+        # the exception on its way up, already counted
+        self.error = None
+
+
+class GraphMetrics:
+    """Metrics of the nodes and queue connections of an instrumented graph.
+    """
+
+    def __init__(self, sample_every=1):
+        if sample_every < 1:
+            raise ValueError(f'sample_every must be at least 1, '
+                             f'not {sample_every}')
+        self.sample_every = sample_every
+        # {node name: NodeStats}
+        self.nodes = {}
+        self.queues = []
+        self.state = _State()
+        # (node, counting out_nodes, timing out_nodes) of the nodes whose
+        # out_nodes are switched while sampled messages are on their way
+        self._switches = []
+        self._sampling = 0
+        self._lock = threading.Lock()
+
+    def _start_sampling(self):
+        if self._switches:
+            with self._lock:
+                self._sampling += 1
+                if self._sampling == 1:
+                    for (node, counting, timing) in self._switches:
+                        node.out_nodes = timing
+
+    def _stop_sampling(self):
+        if self._switches:
+            with self._lock:
+                self._sampling -= 1
+                if not self._sampling:
+                    for (node, counting, timing) in self._switches:
+                        node.out_nodes = counting
+
+    def snapshot(self):
+        """Return the current metrics as a dict.
+        """
+        return {
+            'sample_every': self.sample_every,
+            'nodes': {name: stats.as_dict()
+                      for (name, stats) in self.nodes.items()},
+            'queues': {queue.name: queue.metrics() for queue in self.queues},
+            }
+
+    def prometheus(self):
+        """Return the current metrics in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+            for (suffix, labels, value) in samples:
+                labels = ','.join(f'{key}="{_escape(value)}"'
+                                  for (key, value) in labels.items())
+                lines.append(f'{PREFIX}_{name}{suffix}{{{labels}}} {value}')
+
+        nodes = snapshot['nodes']
+        metric('node_messages_total', 'counter', 'Messages sent to the node.',
+               [('', {'node': name}, stats['messages'])
+                for (name, stats) in nodes.items()])
+        metric('node_errors_total', 'counter',
+               'Exceptions raised by the node.',
+               [('', {'node': name}, stats['errors'])
+                for (name, stats) in nodes.items()])
+        samples = []
+        for (name, stats) in nodes.items():
+            for q in QUANTILES:
+                samples.append(('', {'node': name, 'quantile': q / 100},
+                                stats[f'p{q}_ns'] / 1e9))
+            samples.append(('_sum', {'node': name}, stats['self_ns'] / 1e9))
+            samples.append(('_count', {'node': name}, stats['sampled']))
+        metric('node_latency_seconds', 'summary',
+               'Sampled processing time of the node, without its out_nodes.',
+               samples)
+
+        queues = snapshot['queues']
+        for (name, kind, help) in [
+                ('depth', 'gauge', 'Messages in the buffer.'),
+                ('max_depth', 'gauge', 'Maximum messages in the buffer.'),
+                ('delivered', 'counter', 'Messages delivered.'),
+                ('dropped', 'counter', 'Messages dropped.'),
+                ('errors', 'counter', 'Exceptions raised by the consumer.'),
+                ('blocked_seconds', 'counter',
+                 'Time producers spent blocked.'),
+                ('wait_seconds', 'counter',
+                 'Time delivered messages waited in the buffer.'),
+                ('max_wait_seconds', 'gauge',
+                 'Maximum time a message waited in the buffer.')]:
+            metric(f'queue_{name}' + ('_total' if kind == 'counter' else ''),
+                   kind, help,
+                   [('', {'consumer': consumer}, metrics[name])
+                    for (consumer, metrics) in queues.items()])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write the current metrics to the file path in the Prometheus text
+        format.
+
+        The file is replaced atomically, so readers never see partial data.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fp:
+            fp.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+def _escape(value):
+    """Escape a Prometheus label value.
+    """
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+class MeteredNode(ConsumingNode):
+    """Stand-in for node, counting its messages and errors in metrics.
+    Transparent for the message trail.
+    """
+
+    def __init__(self, node, metrics):
+        super().__init__(node.name)
+        self.node = node
+        self.metrics = metrics
+        self.stats = metrics.nodes.setdefault(node.name, NodeStats())
+        self._state = metrics.state
+
+    def send(self, msg, trail=None):
+        self.stats.messages += 1
+        try:
+            self.node.send(msg, trail=trail)
+        except Exception as exc:
+            self._failed(exc)
+            raise
+
+    def _failed(self, exc):
+        # Only count the error for the node raising it, not for all nodes it
+        # passes through on its way up.
+        state = self._state
+        if exc is not state.error:
+            state.error = exc
+            self.stats.errors += 1
+
+
+class TimedNode(MeteredNode):
+    """MeteredNode timing the sampled messages as well.
+
+    With sample_every > 1 only switched into the graph while sampled
+    messages are on their way, see EntryNode.
+    """
+
+    def send(self, msg, trail=None):
+        state = self._state
+        if state.sampling:
+            self.stats.messages += 1
+            self._send_timed(msg, trail, state)
+        else:
+            # Message of another thread while the stand-ins are switched in.
+            super().send(msg, trail=trail)
+
+    def _send_timed(self, msg, trail, state):
+        children = state.children
+        children.append(0)
+        start = _clock()
+        try:
+            self.node.send(msg, trail=trail)
+        except Exception as exc:
+            self._failed(exc)
+            raise
+        finally:
+            elapsed = _clock() - start
+            own = elapsed - children.pop()
+            if children:
+                children[-1] += elapsed
+            samples = self.stats.samples
+            samples.append((own, elapsed))
+            if len(samples) >= _DRAIN_AT:
+                self.stats.drain()
+
+
+class EntryNode(TimedNode):
+    """TimedNode staying in the graph, for the out_nodes of sources and
+    consumers of queue connections: times every sample_every-th message.
+    """
+
+    def __init__(self, node, metrics):
+        super().__init__(node, metrics)
+        self._countdown = 1
+
+    def send(self, msg, trail=None):
+        self._countdown -= 1
+        if self._countdown > 0:
+            MeteredNode.send(self, msg, trail=trail)
+            return
+        self._countdown = self.metrics.sample_every
+        self.stats.messages += 1
+        state = self._state
+        state.sampling = True
+        state.error = None
+        self.metrics._start_sampling()
+        try:
+            self._send_timed(msg, trail, state)
+        finally:
+            state.sampling = False
+            self.metrics._stop_sampling()
+
+
+def instrument(sources, metrics=None, sample_every=1):
+    """Put MeteredNode stand-ins in front of all consuming nodes reachable
+    from sources (in place), return the GraphMetrics.
+
+    Nodes with the same name share their metrics.
+    """
+    if metrics is None:
+        metrics = GraphMetrics(sample_every)
+    # {(id(node), stand-in class): stand-in}
+    metered = {}
+
+    def wrap(node, cls):
+        if isinstance(node, (MeteredNode, QueuedNode)):
+            return node
+        key = (id(node), cls)
+        if key not in metered:
+            metered[key] = cls(node, metrics)
+        return metered[key]
+
+    seen = set()
+    todo = list(sources)
+    source_ids = set(map(id, sources))
+    while todo:
+        node = todo.pop()
+        if isinstance(node, MeteredNode):
+            node = node.node
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, QueuedNode):
+            metrics.queues.append(node)
+            todo.append(node.consumer)
+            node.consumer = wrap(node.consumer, EntryNode)
+        if hasattr(node, 'out_nodes'):
+            todo.extend(node.out_nodes)
+            if id(node) in source_ids:
+                node.out_nodes = [wrap(out_node, EntryNode)
+                                  for out_node in node.out_nodes]
+            elif metrics.sample_every == 1:
+                node.out_nodes = [wrap(out_node, TimedNode)
+                                  for out_node in node.out_nodes]
+            else:
+                timing = [wrap(out_node, TimedNode)
+                          for out_node in node.out_nodes]
+                node.out_nodes = [wrap(out_node, MeteredNode)
+                                  for out_node in node.out_nodes]
+                metrics._switches.append((node, node.out_nodes, timing))
+    return metrics
+
+
+class SlowConnector(Connector):
+    """Connector taking delay seconds per message.
+    """
+
+    def __init__(self, name, delay=0.0001):
+        super().__init__(name)
+        self.delay = delay
+
+    def send(self, msg, trail=None):
+        time.sleep(self.delay)
+        super().send(msg, trail=trail)
+
+
+class FailingSink(ConsumingNode):
+    """Sink raising ValueError for every failure_rate-th message.
+    """
+
+    def __init__(self, name, failure_rate=100):
+        super().__init__(name)
+        self.failure_rate = failure_rate
+        self.count = 0
+
+    def send(self, msg, trail=None):
+        self.count += 1
+        if not self.count % self.failure_rate:
+            raise ValueError(f'Cannot process message {msg}')
+
+
+def benchmark(count=100_000, chain_length=10):
+    """Print the throughput of a chain of connectors without and with
+    instrumentation, for several sampling rates.
+    """
+    for sample_every in (None, 1, 10, 100):
+        sink = CountingSink('Sink')
+        source = chain_graph(sink, chain_length)
+        if sample_every:
+            instrument([source], sample_every=sample_every)
+        start = time.perf_counter()
+        for _ in range(count):
+            trigger(source)
+        elapsed = time.perf_counter() - start
+        print(f'chain of {chain_length} '
+              f'sample_every={sample_every!s:4}: '
+              f'{sink.count / elapsed:10.0f} msgs/s')
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure the instrumentation overhead')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of messages to produce')
+    parser.add_argument('--sample_every', type=int, default=1,
+                        help='time only every n-th message')
+    parser.add_argument('--prometheus', metavar='PATH',
+                        help='write the metrics to PATH in the Prometheus '
+                             'text format')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark(args.count)
+        return
+
+    #                        /--> Slow --> Failing
+    # Source --> Dispatch --<
+    #                        \--> queue --> SlowSink
+    source = CounterSource('Source')
+    dispatch = Connector('Dispatch')
+    slow = SlowConnector('Slow')
+    source.add_out_nodes([dispatch])
+    dispatch.add_out_nodes([slow])
+    slow.add_out_nodes([FailingSink('Failing')])
+    connection = connect(dispatch, SlowSink('SlowSink', delay=0.0002,
+                                            quiet=True))
+    metrics = instrument([source], sample_every=args.sample_every)
+    for _ in range(args.count):
+        try:
+            source.trigger()
+        except ValueError:
+            pass
+    connection.close()
+
+    snapshot = metrics.snapshot()
+    for (name, stats) in sorted(snapshot['nodes'].items(),
+                                key=lambda item: -item[1]['self_ns']):
+        print(f'{name:>10}: {stats["messages"]:6} msgs '
+              f'{stats["errors"]:4} errors, '
+              f'mean {stats["mean_ns"] / 1000:8.1f}us, '
+              f'p99 {stats["p99_ns"] / 1000:8.1f}us')
+    for (name, queue) in snapshot['queues'].items():
+        print(f'{name:>10}: queue wait {queue["wait_seconds"]:.3f}s, '
+              f'max {queue["max_wait_seconds"] * 1000:.1f}ms')
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+"""Run subgraphs of the node graph in worker processes.
+
+All nodes of multiple_inheritance.py run in the producer's thread, so a CPU
+heavy connector limits the whole graph to one CPU core. A ProcessNode stands
+in for a node in its producer's out_nodes and runs that node - and all nodes
+downstream of it - in a worker process. Messages are collected into batches,
+pickled and moved to the worker through a shared-memory ring buffer (or a
+multiprocessing pipe as a fallback), where they are passed on to the node's
+send(msg, trail), just like in a single process.
+
+Nodes and messages must be picklable. Results stay in the worker process,
+close() returns the worker's copy of the node (and thus its subgraph) to
+inspect its final state. If the worker fails, send(), flush() and close()
+raise a RuntimeError with its traceback.
+"""
+
+import multiprocessing
+import pickle
+import queue
+import struct
+import sys
+import time
+import traceback
+from multiprocessing import shared_memory
+
+from multiple_inheritance import ConsumingNode, Connector, CounterSource
+from pipeline import CountingSink
+
+_HEADER = struct.Struct('<QQ')  # total bytes written, total bytes read
+_LENGTH = struct.Struct('<I')
+# Length marking skipped space at the end of the data area. An empty record
+# ends the stream.
+_WRAP = 0xFFFFFFFF
+
+
+class RingBuffer:
+    """Single producer, single consumer ring buffer of byte records in shared
+    memory.
+
+    Positions are kept as total byte counts in a header in front of the data
+    area. A record that doesn't fit into the rest of the data area is
+    written at its start instead, marking the skipped space with _WRAP.
+    """
+
+    def __init__(self, capacity=1 << 22):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=_HEADER.size + capacity)
+        _HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        self.data_written = multiprocessing.Event()
+        self.data_read = multiprocessing.Event()
+
+    def __getstate__(self):
+        # Pass the shared memory on by name to the worker process.
+        state = self.__dict__.copy()
+        state['shm'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state['shm'])
+
+    def _positions(self):
+        return _HEADER.unpack_from(self.shm.buf, 0)
+
+    def put(self, data, check=None):
+        """Write data as a record, waiting for free space if necessary.
+
+        check, if given, is called while waiting, to give up by raising an
+        exception (e.g. when the consumer died).
+        """
+        size = _LENGTH.size + len(data)
+        # Limit records to half the capacity, so that even after skipping the
+        # rest of the data area a record fits into the emptied buffer.
+        if size > self.capacity // 2:
+            raise ValueError(f'Record of {len(data)} bytes exceeds half the '
+                             f'ring buffer capacity of {self.capacity} bytes')
+        buf = self.shm.buf
+        while True:
+            (written, read) = self._positions()
+            offset = written % self.capacity
+            rest = self.capacity - offset
+            skip = rest if rest < size else 0
+            if skip + size <= self.capacity - (written - read):
+                break
+            # Clear before checking again to not miss a wake-up.
+            self.data_read.clear()
+            (written, read) = self._positions()
+            if skip + size <= self.capacity - (written - read):
+                break
+            if check is not None:
+                check()
+            self.data_read.wait(0.1)
+        if skip:
+            if skip >= _LENGTH.size:
+                _LENGTH.pack_into(buf, _HEADER.size + offset, _WRAP)
+            (written, offset) = (written + skip, 0)
+        start = _HEADER.size + offset
+        _LENGTH.pack_into(buf, start, len(data))
+        buf[start + _LENGTH.size:start + size] = data
+        struct.pack_into('<Q', buf, 0, written + size)
+        self.data_written.set()
+
+    def get(self):
+        """Return the next record, waiting for one if necessary.
+        """
+        buf = self.shm.buf
+        while True:
+            (written, read) = self._positions()
+            if written == read:
+                self.data_written.clear()
+                (written, read) = self._positions()
+                if written == read:
+                    self.data_written.wait(0.1)
+                    continue
+            offset = read % self.capacity
+            rest = self.capacity - offset
+            if rest < _LENGTH.size:
+                length = _WRAP
+            else:
+                (length,) = _LENGTH.unpack_from(buf, _HEADER.size + offset)
+            if length == _WRAP:
+                struct.pack_into('<Q', buf, 8, read + rest)
+                continue
+            start = _HEADER.size + offset + _LENGTH.size
+            data = bytes(buf[start:start + length])
+            struct.pack_into('<Q', buf, 8, read + _LENGTH.size + length)
+            self.data_read.set()
+            return data
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class PipeTransport:
+    """Fallback transport of byte records through a multiprocessing pipe.
+    """
+
+    def __init__(self):
+        (self.receiver, self.sender) = multiprocessing.Pipe(duplex=False)
+
+    def put(self, data, check=None):
+        # Raises BrokenPipeError if the receiving process died.
+        self.sender.send_bytes(data)
+
+    def get(self):
+        return self.receiver.recv_bytes()
+
+    def close(self, unlink=False):
+        pass
+
+
+def _work(node, transport, results):
+    """Worker process main function: pass the received message batches on to
+    node, finally send node (or a RuntimeError if that failed) back through
+    the results queue.
+    """
+    try:
+        send = node.send
+        while data := transport.get():
+            for (msg, trail) in pickle.loads(data):
+                send(msg, trail=trail)
+        results.put(node)
+    except BaseException:
+        # The traceback text, as the exception might not be picklable.
+        results.put(RuntimeError(f'Worker process of {node.name} failed:\n'
+                                 f'{traceback.format_exc()}'))
+        raise
+    finally:
+        transport.close()
+
+
+class ProcessNode(ConsumingNode):
+    """Stand-in for node, running it and its downstream nodes in a worker
+    process.
+
+    transport is 'shm' (a shared-memory ring buffer) or 'pipe'. Transparent
+    for the message trail.
+    """
+
+    def __init__(self, node, batch_size=1000, transport='shm',
+                 capacity=1 << 22):
+        super().__init__(node.name)
+        self.batch_size = batch_size
+        self._batch = []
+        if transport == 'shm':
+            self.transport = RingBuffer(capacity)
+        elif transport == 'pipe':
+            self.transport = PipeTransport()
+        else:
+            raise ValueError(f'Unknown transport {transport!r}')
+        self._released = False
+        self._results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_work, args=(node, self.transport, self._results),
+            name=f'ProcessNode-{node.name}', daemon=True)
+        self.process.start()
+        if transport == 'pipe':
+            # Only the worker reads, so that writing fails once it died.
+            self.transport.receiver.close()
+
+    def send(self, msg, trail=None):
+        self._batch.append((msg, trail))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Send the collected messages to the worker process.
+        """
+        if self._batch:
+            self._put(pickle.dumps(self._batch, pickle.HIGHEST_PROTOCOL))
+            self._batch = []
+
+    def _put(self, data):
+        try:
+            self.transport.put(data, self._check_worker)
+        except BrokenPipeError:
+            # The worker died, give it a moment to be reaped.
+            self.process.join(1)
+            self._check_worker()
+            raise
+
+    def _check_worker(self):
+        """Raise the worker's error if the worker process is gone.
+        """
+        if not self.process.is_alive():
+            # No close() needed after an error.
+            self._release()
+            self._result()
+            raise RuntimeError(f'{self.process.name} exited early')
+
+    def _release(self):
+        """Stop the worker process if still running and free the transport.
+        """
+        if self.process.is_alive():
+            self.process.terminate()
+        if not self._released:
+            self._released = True
+            self.transport.close(unlink=True)
+
+    def _result(self):
+        """Return the worker's result, raising its error.
+        """
+        while True:
+            try:
+                result = self._results.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.process.is_alive():
+                    continue
+            # The worker is gone, but its result may have been on the way.
+            try:
+                result = self._results.get(timeout=0.1)
+                break
+            except queue.Empty:
+                raise RuntimeError(
+                    f'{self.process.name} exited with code '
+                    f'{self.process.exitcode}') from None
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def close(self):
+        """Flush, stop the worker process after it processed all messages and
+        return its copy of the node.
+        """
+        try:
+            self.flush()
+            self._put(b'')
+            node = self._result()
+            self.process.join()
+        finally:
+            self._release()
+        return node
+
+
+class Distributor(Connector):
+    """Connector passing every message on to only one of its out_nodes, in
+    turn.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._next = 0
+
+    def send(self, msg, trail=None):
+        trail = None if trail is None else trail + (self.name,)
+        node = self.out_nodes[self._next]
+        self._next = (self._next + 1) % len(self.out_nodes)
+        node.send(msg, trail=trail)
+
+
+class WorkConnector(Connector):
+    """CPU-heavy connector, doing some calculation for every message.
+    """
+
+    def __init__(self, name, work=2000):
+        super().__init__(name)
+        self.work = work
+
+    def send(self, msg, trail=None):
+        msg = sum(i * i for i in range(self.work)) + msg
+        super().send(msg, trail=trail)
+
+
+def benchmark(count=20_000, max_workers=None, work=2000, transport='shm'):
+    """Print the throughput of a Source -> Distributor -> n x
+    (WorkConnector -> CountingSink) graph for n worker processes.
+    """
+    max_workers = max_workers or multiprocessing.cpu_count()
+    for workers in [0] + [2**i for i in range(max_workers.bit_length())
+                          if 2**i <= max_workers]:
+        source = CounterSource('Source')
+        distributor = Distributor('Distributor')
+        source.add_out_nodes([distributor])
+        subgraphs = []
+        for i in range(max(workers, 1)):
+            worker = WorkConnector(f'Work{i}', work)
+            worker.add_out_nodes([CountingSink(f'Sink{i}')])
+            subgraphs.append(worker)
+        if workers:
+            subgraphs = [ProcessNode(node, transport=transport)
+                         for node in subgraphs]
+        distributor.add_out_nodes(subgraphs)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            source.trigger()
+        if workers:
+            subgraphs = [node.close() for node in subgraphs]
+        elapsed = time.perf_counter() - start
+        received = sum(node.out_nodes[0].count for node in subgraphs)
+        assert received == count, f'{received} of {count} messages arrived'
+        print(f'{workers:3} worker processes: {count / elapsed:10.0f} msgs/s')
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=20_000,
+                        help='number of messages per benchmark run')
+    parser.add_argument('--workers', type=int,
+                        help='maximum number of worker processes '
+                             '(default: CPU count)')
+    parser.add_argument('--work', type=int, default=2000,
+                        help='amount of calculation per message')
+    parser.add_argument('--transport', choices=['shm', 'pipe'],
+                        default='shm',
+                        help='how to move messages between processes')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    benchmark(args.count, args.workers, args.work, args.transport)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Bounded queues with backpressure between node graph nodes.
+
+In multiple_inheritance.py a producing node calls its out_nodes' send()
+directly, so a slow sink stalls the whole CounterSource.trigger() loop. A
+QueuedNode connection decouples them: it stands in for the consumer in the
+producer's out_nodes, puts the messages into a bounded buffer and a worker
+thread passes them on to the consumer's send() at its own pace.
+
+When the buffer is full the backpressure policy decides:
+
+- 'block': the producer waits until there is room again.
+- 'drop-oldest': the oldest buffered message is dropped.
+- 'drop-newest': the new message is dropped.
+
+Every connection counts its messages in and out, dropped messages, consumer
+errors, the current and maximum buffer depth, the time producers spent
+blocked, the time messages waited in the buffer and the throughput.
+
+An exception of the consumer doesn't stop the worker thread: it is counted,
+the first one is kept and raised again by close().
+"""
+
+import collections
+import sys
+import threading
+import time
+
+from multiple_inheritance import ConsumingNode, CounterSource, PrinterSink
+
+POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+
+class QueuedNode(ConsumingNode):
+    """Queue-backed connection to the consumer node.
+
+    Use connect() to set one up. Transparent for the message trail.
+    """
+
+    def __init__(self, consumer, maxsize=1000, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown backpressure policy {policy!r}, '
+                             f'use one of {POLICIES}')
+        if maxsize < 1:
+            raise ValueError(f'maxsize must be at least 1, not {maxsize}')
+        super().__init__(consumer.name)
+        self.consumer = consumer
+        self.maxsize = maxsize
+        self.policy = policy
+        self._buffer = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        # first exception of the consumer
+        self.error = None
+        self.max_depth = 0
+        self.blocked_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.started = time.perf_counter()
+        self._worker = threading.Thread(
+            target=self._run, name=f'QueuedNode-{self.name}', daemon=True)
+        self._worker.start()
+
+    def send(self, msg, trail=None):
+        """Buffer the message for the consumer, applying the backpressure
+        policy if the buffer is full.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f'Connection to {self.name!r} is closed')
+            self.received += 1
+            if len(self._buffer) >= self.maxsize:
+                if self.policy == 'drop-newest':
+                    self.dropped += 1
+                    return
+                elif self.policy == 'drop-oldest':
+                    self._buffer.popleft()
+                    self.dropped += 1
+                else:
+                    start = time.perf_counter()
+                    while len(self._buffer) >= self.maxsize:
+                        self._not_full.wait()
+                    self.blocked_seconds += time.perf_counter() - start
+            self._buffer.append((msg, trail, time.perf_counter()))
+            if len(self._buffer) > self.max_depth:
+                self.max_depth = len(self._buffer)
+            self._not_empty.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closed:
+                    self._not_empty.wait()
+                if not self._buffer:
+                    # closed and drained
+                    return
+                (msg, trail, enqueued) = self._buffer.popleft()
+                self._not_full.notify()
+            wait = time.perf_counter() - enqueued
+            try:
+                # The consumer may get replaced (e.g. by an instrumenting
+                # stand-in), so look it up for every message.
+                self.consumer.send(msg, trail=trail)
+            except Exception as e:
+                # Only the worker thread writes errors, delivered and the
+                # wait times.
+                self.errors += 1
+                if self.error is None:
+                    self.error = e
+            else:
+                self.delivered += 1
+            self.wait_seconds += wait
+            if wait > self.max_wait_seconds:
+                self.max_wait_seconds = wait
+
+    def close(self):
+        """Stop accepting messages, wait until the buffered ones have been
+        delivered, raise the first exception of the consumer if any.
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify()
+        self._worker.join()
+        if self.error is not None:
+            raise self.error
+
+    def metrics(self):
+        """Return the connection's metrics as a dict.
+        """
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            return {
+                'consumer': self.name,
+                'policy': self.policy,
+                'maxsize': self.maxsize,
+                'depth': len(self._buffer),
+                'max_depth': self.max_depth,
+                'received': self.received,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'blocked_seconds': self.blocked_seconds,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+                'in_per_second': self.received / elapsed,
+                'out_per_second': self.delivered / elapsed,
+                }
+
+
+def connect(producer, consumer, maxsize=1000, policy='block'):
+    """Connect producer to consumer through a bounded queue, return the
+    QueuedNode connection.
+    """
+    connection = QueuedNode(consumer, maxsize=maxsize, policy=policy)
+    producer.add_out_nodes([connection])
+    return connection
+
+
+class SlowSink(PrinterSink):
+    """Print incoming data messages, taking delay seconds per message.
+    """
+
+    def __init__(self, name, delay=0.001, quiet=False):
+        super().__init__(name)
+        self.delay = delay
+        self.quiet = quiet
+
+    def send(self, msg, trail=None):
+        time.sleep(self.delay)
+        if not self.quiet:
+            super().send(msg, trail=trail)
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of messages to produce')
+    parser.add_argument('--maxsize', type=int, default=100,
+                        help='buffer size of the connection')
+    parser.add_argument('--delay', type=float, default=0.001,
+                        help='seconds the sink takes per message')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    for policy in POLICIES:
+        source = CounterSource('Source')
+        sink = SlowSink('Sink', delay=args.delay, quiet=True)
+        connection = connect(source, sink, maxsize=args.maxsize,
+                             policy=policy)
+        start = time.perf_counter()
+        for _ in range(args.count):
+            source.trigger()
+        produced = time.perf_counter() - start
+        connection.close()
+        print(f'{policy:>11}: produced in {produced:.3f}s, '
+              f'{connection.metrics()}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
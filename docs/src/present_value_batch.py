@@ -0,0 +1,177 @@
+"""Calculate present values for many cash flow schedules at once.
+
+Batch counterpart to present_value.py: instead of looping over one hard-coded
+list of cash flows and recomputing q**(-t) for every term, the discount
+factors 1, q**-1, q**-2, ... are computed once per interest rate and each
+present value becomes a simple dot product.
+
+Uses NumPy if it is installed and falls back to pure Python otherwise.
+"""
+
+import itertools
+import operator
+import random
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def present_value_loop(cashflows, interest_rate):
+    """Return the present value of cashflows, the present_value.py way.
+    """
+    q = 1 + interest_rate
+    present_value = 0
+    for (t, cf) in enumerate(cashflows):
+        present_value += cf * q**(-t)
+    return present_value
+
+
+def discount_factors(periods, interest_rate):
+    """Return the list of discount factors [q**0, q**-1, ..., q**-(periods-1)]
+    for q = 1 + interest_rate.
+    """
+    v = 1 / (1 + interest_rate)
+    # Repeated multiplication instead of one power per term.
+    return list(itertools.accumulate(
+        itertools.repeat(v, periods - 1), operator.mul, initial=1.0))
+
+
+def _broadcast_rates(interest_rates, count):
+    """Return interest_rates as a sequence with one rate per schedule.
+
+    A single number is used for all schedules.
+    """
+    if isinstance(interest_rates, (int, float)):
+        return [interest_rates] * count
+    if len(interest_rates) != count:
+        raise ValueError(
+            f'Got {len(interest_rates)} interest rates for {count} schedules')
+    return interest_rates
+
+
+def present_values_python(schedules, interest_rates):
+    """Return the list of present values for the cash flow schedules.
+
+    schedules is a sequence of equally long cash flow sequences (i.e. a 2-d
+    array), interest_rates a single rate or one rate per schedule.
+    Pure Python implementation.
+    """
+    rates = _broadcast_rates(interest_rates, len(schedules))
+    if not schedules:
+        return []
+    periods = len(schedules[0])
+    if any(len(cashflows) != periods for cashflows in schedules):
+        raise ValueError('schedules must be a 2-d array of cash flows')
+    # Only compute the discount factor vector once per distinct rate.
+    factors = {}
+    pvs = []
+    for (cashflows, rate) in zip(schedules, rates):
+        try:
+            dfs = factors[rate]
+        except KeyError:
+            dfs = factors[rate] = discount_factors(periods, rate)
+        pvs.append(sum(map(operator.mul, cashflows, dfs)))
+    return pvs
+
+
+def present_values_numpy(schedules, interest_rates):
+    """Return the array of present values for the cash flow schedules.
+
+    Same as present_values_python() but vectorized with NumPy.
+    """
+    cashflows = numpy.asarray(schedules, dtype=float)
+    if cashflows.ndim != 2:
+        raise ValueError('schedules must be a 2-d array of cash flows')
+    (count, periods) = cashflows.shape
+    rates = numpy.asarray(_broadcast_rates(interest_rates, count),
+                          dtype=float)
+    # (count, periods) matrix of discount factors: q**-t per schedule.
+    dfs = (1 + rates)[:, numpy.newaxis] ** -numpy.arange(periods)
+    return numpy.einsum('ij,ij->i', cashflows, dfs)
+
+
+if numpy is not None:
+    present_values = present_values_numpy
+else:
+    present_values = present_values_python
+
+
+def benchmark(counts=(1_000, 100_000, 1_000_000), periods=6):
+    """Print the throughput (schedules per second) of the loop, pure Python
+    and (if available) NumPy present value implementations.
+
+    NumPy gets its input as arrays, converted outside of the timing.
+    """
+    funcs = [
+        ('loop', lambda s, r: [present_value_loop(cfs, rate)
+                               for (cfs, rate) in zip(s, r)], None),
+        ('python', present_values_python, None),
+        ]
+    if numpy is not None:
+        funcs.append(('numpy', present_values_numpy,
+                      lambda s, r: (numpy.asarray(s, dtype=float),
+                                    numpy.asarray(r, dtype=float))))
+
+    rng = random.Random(42)
+    for count in counts:
+        schedules = [[rng.uniform(-100, 200) for _ in range(periods)]
+                     for _ in range(count)]
+        # A handful of distinct rates, like a rate curve scenario set.
+        rates = [rng.choice((0.01, 0.02, 0.03, 0.04)) for _ in range(count)]
+        for (name, func, convert) in funcs:
+            args = (schedules, rates) if convert is None else convert(
+                schedules, rates)
+            start = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>6}: {count:>9} schedules in {elapsed:8.3f}s '
+                  f'= {count / elapsed:12.0f} schedules/s')
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--benchmark', action='store_true',
+        help='compare throughput against the present_value.py loop')
+    parser.add_argument(
+        '--counts', type=int, nargs='+', default=[1_000, 100_000, 1_000_000],
+        help='numbers of schedules to benchmark')
+    parser.add_argument(
+        '--periods', type=int, default=6,
+        help='number of cash flows per benchmark schedule')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark(args.counts, args.periods)
+        return
+
+    schedules = [[-100, -2, 3, 6, 8, 110],
+                 [-100, 5, 5, 5, 5, 105]]
+    interest_rates = [0.03, 0.05]
+    for (cashflows, rate, pv) in zip(
+            schedules, interest_rates,
+            present_values(schedules, interest_rates)):
+        print(f'Present value for cash flows {cashflows} and interest rate '
+              f'{rate}:\n    PV = {pv}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Class registry with indexed lookups and lazily imported entries.
+
+Extends the Registry class decorator example of the decorators chapter (see
+decorator_examples.py), whose lookups are linear scans of one list:
+
+- Registered classes are indexed by name, by (all of their) base classes and
+  by arbitrary tags, so lookups are dict accesses.
+- Entries can also be registered lazily as 'module:ClassName' strings. The
+  module only gets imported when the class is looked up, so processes with
+  lots of plugins start fast.
+"""
+
+import collections
+import importlib
+import sys
+
+
+class Registry:
+    """Registry of classes, indexed by name, base class and tag.
+    """
+
+    def __init__(self):
+        # {name: class or 'module:ClassName' string for unresolved entries}
+        self._entries = {}
+        # {tag: [name, ...]}
+        self._tags = collections.defaultdict(list)
+        # {base class: [name, ...]}, only for resolved entries
+        self._bases = collections.defaultdict(list)
+
+    def register(self, register_cls=None, *, name=None, tags=()):
+        """Class decorator registering a class under its name (or name),
+        with tags.
+
+        Can be used both as @register and with arguments, e.g.
+        @register(tags=['plugin']).
+        """
+        def decorate(register_cls):
+            self._add(name or register_cls.__name__, tags)
+            self._resolved(name or register_cls.__name__, register_cls)
+            return register_cls
+
+        if register_cls is None:
+            # called with arguments
+            return decorate
+        else:
+            # invoked without arguments
+            return decorate(register_cls)
+
+    def register_lazy(self, target, *, name=None, tags=()):
+        """Register the class given as a 'module:ClassName' target string,
+        to be imported on first lookup.
+        """
+        (module_name, sep, qualname) = target.partition(':')
+        if not (module_name and sep and qualname):
+            raise ValueError(
+                f"Lazy entry {target!r} is not of the form 'module:ClassName'")
+        name = name or qualname.rpartition('.')[2]
+        self._add(name, tags)
+        self._entries[name] = target
+
+    def _add(self, name, tags):
+        if name in self._entries:
+            raise ValueError(f'A class named {name!r} is already registered')
+        self._entries[name] = None
+        for tag in tags:
+            self._tags[tag].append(name)
+
+    def _resolved(self, name, cls):
+        """Store the resolved class of entry name and index its bases.
+        """
+        self._entries[name] = cls
+        for base in cls.__mro__[1:]:
+            if base is not object:
+                self._bases[base].append(name)
+
+    def get(self, name):
+        """Return the class registered as name, importing it if necessary.
+
+        Raises KeyError for unknown names.
+        """
+        entry = self._entries[name]
+        if isinstance(entry, str):
+            (module_name, _, qualname) = entry.partition(':')
+            cls = importlib.import_module(module_name)
+            for attr in qualname.split('.'):
+                cls = getattr(cls, attr)
+            self._resolved(name, cls)
+            return cls
+        return entry
+
+    __getitem__ = get
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def names(self):
+        """Return the list of registered names, without importing anything.
+        """
+        return list(self._entries)
+
+    def by_tag(self, tag):
+        """Return the list of classes registered with tag, importing (only)
+        those lazy entries.
+        """
+        return [self.get(name) for name in self._tags.get(tag, ())]
+
+    def by_base(self, base):
+        """Return the list of registered (strict) subclasses of base.
+
+        Base classes of lazy entries are only known after importing them, so
+        this resolves all remaining lazy entries first.
+        """
+        self.resolve_all()
+        return [self._entries[name] for name in self._bases.get(base, ())]
+
+    def resolve_all(self):
+        """Import all lazy entries.
+        """
+        for (name, entry) in list(self._entries.items()):
+            if isinstance(entry, str):
+                self.get(name)
+
+    def registered_classes(self):
+        """Return the list of all registered classes, importing lazy entries.
+        """
+        self.resolve_all()
+        return list(self._entries.values())
+
+
+registry = Registry()
+register = registry.register
+register_lazy = registry.register_lazy
+
+
+def main():
+    class Base:
+        pass
+
+    @register
+    class MyClass1(Base):
+        pass
+
+    @register(tags=['special'])
+    class MyClass2(Base):
+        pass
+
+    register_lazy('fractions:Fraction', tags=['special', 'numbers'])
+    register_lazy('decimal:Decimal', tags=['numbers'])
+
+    print(f'names: {registry.names()}')
+    print(f"'MyClass1' -> {registry.get('MyClass1')}")
+    print(f"fractions imported: {'fractions' in sys.modules}")
+    print(f"'special' -> {registry.by_tag('special')}")
+    print(f"fractions imported: {'fractions' in sys.modules}")
+    print(f"subclasses of Base -> {registry.by_base(Base)}")
+    print(f'registered classes: {registry.registered_classes()}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
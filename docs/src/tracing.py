@@ -0,0 +1,545 @@
+"""Tracing decorators with (almost) zero overhead.
+
+Production versions of the trace() and traced() decorators from the
+decorators chapter (see decorator_examples.py):
+
+- Tracing is switched on and off globally with enable() and disable(), or by
+  setting the CPYCOURSE_TRACE environment variable. As the switch is checked
+  when decorating, disabled tracing returns the original functions and
+  classes unchanged and costs nothing at call time.
+- Wrappers return the wrapped function's result.
+- Trace records are handed to a sink as plain tuples and only formatted when
+  written. The default PrintSink prints them right away, a BufferedSink
+  collects them in a ring buffer that a background thread writes out.
+  Note that arguments and results are thus formatted later and show their
+  state at that time.
+
+The profiled() decorator uses the same wrapping machinery to record call
+counts, cumulative latency and latency histograms per function or method,
+queryable with profile_stats() and dumpable as JSON with dump_profile().
+
+Coroutine functions and async generator functions get async wrappers, which
+trace and time the awaited execution rather than the coroutine creation.
+With a BufferedSink emitting trace records never blocks the event loop.
+"""
+
+import atexit
+import collections
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+_enabled = os.environ.get('CPYCOURSE_TRACE', '') not in ('', '0')
+
+
+def enable(flag=True):
+    """Enable (or disable, for a false flag) tracing for functions and
+    classes decorated from now on.
+    """
+    global _enabled
+    _enabled = bool(flag)
+
+
+def disable():
+    """Disable tracing for functions and classes decorated from now on.
+    """
+    enable(False)
+
+
+def is_enabled():
+    """Return True if tracing is enabled.
+    """
+    return _enabled
+
+
+def format_record(record):
+    """Return the trace output line for a trace record tuple.
+    """
+    (kind, name, *data) = record
+    if kind == '-->':
+        (args, kwargs) = data
+        return f'--> {name}(args={args}, kwargs={kwargs})'
+    else:
+        (result,) = data
+        return f'<-- {name} -> {result}'
+
+
+class PrintSink:
+    """Trace sink that immediately prints trace records to stream (stdout by
+    default).
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, record):
+        print(format_record(record), file=self.stream or sys.stdout)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedSink:
+    """Trace sink that appends trace records to a ring buffer of size
+    capacity, which gets written to stream (stdout by default) by a
+    background thread every interval seconds and at interpreter exit.
+
+    Emitting a record never blocks. If the buffer is full the oldest records
+    are dropped.
+    """
+
+    def __init__(self, stream=None, capacity=100_000, interval=0.1):
+        self.stream = stream
+        self.interval = interval
+        self._buffer = collections.deque(maxlen=capacity)
+        # deque.append() is atomic, so use it as emit() directly.
+        self.emit = self._buffer.append
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='BufferedSink', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write out all buffered trace records.
+        """
+        with self._flush_lock:
+            popleft = self._buffer.popleft
+            lines = []
+            try:
+                while True:
+                    lines.append(format_record(popleft()))
+            except IndexError:
+                pass
+            if lines:
+                stream = self.stream or sys.stdout
+                stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+
+    def close(self):
+        """Stop the background thread and write out the remaining records.
+        """
+        if not self._closed.is_set():
+            self._closed.set()
+            self._thread.join()
+            self.flush()
+            atexit.unregister(self.close)
+
+
+_sink = PrintSink()
+
+
+def set_sink(sink):
+    """Set the sink for all trace records, return the previous one.
+    """
+    global _sink
+    (old_sink, _sink) = (_sink, sink)
+    return old_sink
+
+
+def _tracer(entry=True, exit=True):
+    """Return a decorator function wrapping a function for entry and/or exit
+    tracing.
+
+    Coroutine functions are traced on entry and when their awaited execution
+    has finished, async generator functions on entry and on exhaustion.
+    """
+    def trace(func):
+        name = func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def _wrapper(*args, **kwargs):
+                if entry:
+                    _sink.emit(('-->', name, args, kwargs))
+                result = await func(*args, **kwargs)
+                if exit:
+                    _sink.emit(('<--', name, result))
+                return result
+
+        elif inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def _wrapper(*args, **kwargs):
+                if entry:
+                    _sink.emit(('-->', name, args, kwargs))
+                agen = func(*args, **kwargs)
+                try:
+                    async for item in agen:
+                        yield item
+                finally:
+                    await agen.aclose()
+                if exit:
+                    _sink.emit(('<--', name, None))
+
+        else:
+            @functools.wraps(func)
+            def _wrapper(*args, **kwargs):
+                if entry:
+                    _sink.emit(('-->', name, args, kwargs))
+                result = func(*args, **kwargs)
+                if exit:
+                    _sink.emit(('<--', name, result))
+                return result
+
+        return _wrapper
+    return trace
+
+
+def trace(func):
+    """Decorator tracing entry to and exit from func, if tracing is enabled.
+    """
+    if not _enabled:
+        return func
+    return _tracer()(func)
+
+
+def _decorate_methods(cls, decorator):
+    """Apply decorator to the functions, static and class methods defined in
+    the class body of cls (skipping __dunder__ methods), return cls.
+    """
+    for (name, attr) in list(vars(cls).items()):
+        if name.startswith('__'):
+            continue
+        if isinstance(attr, (staticmethod, classmethod)):
+            setattr(cls, name, type(attr)(decorator(attr.__func__)))
+        elif inspect.isfunction(attr):
+            setattr(cls, name, decorator(attr))
+    return cls
+
+
+def traced(cls=None, *, entry=True, exit=True):
+    """Class decorator tracing entry to and/or exit from the class' methods,
+    if tracing is enabled.
+
+    Can be used both as @traced and with arguments, e.g. @traced(entry=False).
+    """
+    def decorate(cls):
+        if not _enabled or not (entry or exit):
+            return cls
+        return _decorate_methods(cls, _tracer(entry, exit))
+
+    if cls is None:
+        # called with arguments
+        return decorate
+    else:
+        # invoked without arguments
+        return decorate(cls)
+
+
+class LatencyHistogram:
+    """Histogram of latencies in nanoseconds with logarithmic buckets of
+    2**significant_bits linear sub-buckets each (HDR histogram style), i.e. a
+    relative precision of about 2**-significant_bits.
+    """
+
+    def __init__(self, significant_bits=5):
+        self.significant_bits = significant_bits
+        self.counts = collections.Counter()
+        self.count = 0
+        self.max = 0
+
+    def record(self, value):
+        shift = max(value.bit_length() - self.significant_bits, 0)
+        # Bucket key is the value with its insignificant bits cleared.
+        self.counts[value >> shift << shift] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values):
+        """Record the list of values, faster than one record() call each.
+        """
+        if not values:
+            return
+        bits = self.significant_bits
+        self.counts.update(
+            value >> shift << shift if (shift := value.bit_length() - bits) > 0
+            else value
+            for value in values)
+        self.count += len(values)
+        self.max = max(self.max, max(values))
+
+    def percentile(self, percent):
+        """Return the (upper bucket bound of the) latency below which percent
+        % of the recorded latencies fall.
+        """
+        if not self.count:
+            return 0
+        threshold = self.count * percent / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= threshold:
+                shift = max(bucket.bit_length() - self.significant_bits, 0)
+                return min(bucket + (1 << shift) - 1, self.max)
+        return self.max
+
+
+class CallStats:
+    """Call count, cumulative latency and latency histogram of a profiled
+    function.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.histogram = LatencyHistogram()
+
+    def record(self, elapsed_ns):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        self.histogram.record(elapsed_ns)
+
+    def as_dict(self):
+        histogram = self.histogram
+        return {
+            'calls': self.calls,
+            'total_ns': self.total_ns,
+            'mean_ns': self.total_ns / self.calls if self.calls else 0,
+            'p50_ns': histogram.percentile(50),
+            'p95_ns': histogram.percentile(95),
+            'p99_ns': histogram.percentile(99),
+            'max_ns': histogram.max,
+            }
+
+
+# {<qualified function name>: CallStats}
+_profiles = {}
+
+
+def _profiler(func):
+    """Wrap func to record its call statistics.
+
+    For coroutine functions the awaited execution is timed, for async
+    generator functions the time spent producing the items (but not the time
+    the consumer spends in between).
+    """
+    stats = _profiles.setdefault(func.__qualname__, CallStats())
+    perf_counter_ns = time.perf_counter_ns
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def _wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                stats.record(perf_counter_ns() - start)
+
+    elif inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def _wrapper(*args, **kwargs):
+            agen = func(*args, **kwargs)
+            elapsed = 0
+            try:
+                while True:
+                    start = perf_counter_ns()
+                    try:
+                        item = await agen.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        elapsed += perf_counter_ns() - start
+                    yield item
+            finally:
+                await agen.aclose()
+                stats.record(elapsed)
+
+    else:
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.record(perf_counter_ns() - start)
+
+    return _wrapper
+
+
+def profiled(obj):
+    """Function or class decorator recording call counts, latencies and
+    latency histograms of the function or the class' methods.
+
+    Statistics are kept per qualified name (e.g. 'FruitSalad.add'). Counting
+    isn't synchronized, so results are approximate with concurrent threads.
+    """
+    if inspect.isclass(obj):
+        return _decorate_methods(obj, _profiler)
+    return _profiler(obj)
+
+
+def profile_stats(name=None):
+    """Return the call statistics of the profiled function name as a dict, or
+    a {<name>: <statistics dict>} dict of all profiled functions if name is
+    None.
+    """
+    if name is not None:
+        return _profiles[name].as_dict()
+    return {name: stats.as_dict() for (name, stats) in _profiles.items()}
+
+
+def dump_profile(fp=None):
+    """Write the call statistics of all profiled functions as JSON to the
+    text file object fp (stdout by default).
+    """
+    fp = fp or sys.stdout
+    json.dump(profile_stats(), fp, indent=2)
+    fp.write('\n')
+
+
+def reset_profile():
+    """Reset the call statistics of all profiled functions.
+    """
+    for stats in _profiles.values():
+        stats.__init__()
+
+
+def benchmark(number=200_000):
+    """Print the per-call overhead of trace() with tracing disabled, enabled
+    with a BufferedSink and enabled with a PrintSink.
+    """
+    import timeit
+
+    def inc(x):
+        return x + 1
+
+    baseline = min(timeit.repeat(lambda: inc(1), number=number, repeat=3))
+    was_enabled = is_enabled()
+    devnull = open(os.devnull, 'w')
+    modes = [
+        ('disabled', False, None),
+        ('enabled-buffered', True, BufferedSink(devnull)),
+        ('enabled-print', True, PrintSink(devnull)),
+        ]
+    try:
+        for (mode, enabled, sink) in modes:
+            enable(enabled)
+            old_sink = set_sink(sink) if sink else None
+            traced_inc = trace(inc)
+            elapsed = min(timeit.repeat(
+                lambda: traced_inc(1), number=number, repeat=3))
+            if sink:
+                sink.close()
+                set_sink(old_sink)
+            overhead = (elapsed - baseline) / number * 1e9
+            print(f'{mode:>16}: {overhead:8.1f} ns overhead per call')
+    finally:
+        enable(was_enabled)
+        devnull.close()
+
+
+def run_tasks(tasks, profile=False):
+    """Run an async example class method in tasks concurrent asyncio tasks,
+    tracing or profiling it.
+    """
+    import asyncio
+
+    enable()
+    sink = BufferedSink()
+    set_sink(sink)
+
+    @(profiled if profile else traced)
+    class Fetcher:
+
+        async def fetch(self, i):
+            # Stands in for some I/O, e.g. a network request.
+            await asyncio.sleep(0.01)
+            return i * 2
+
+        async def fetch_many(self, count):
+            for i in range(count):
+                yield await self.fetch(i)
+
+    async def run():
+        fetcher = Fetcher()
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(fetcher.fetch(i) for i in range(tasks)))
+        elapsed = time.perf_counter() - start
+        items = [item async for item in fetcher.fetch_many(3)]
+        return (len(results), elapsed, items)
+
+    (count, elapsed, items) = asyncio.run(run())
+    sink.close()
+    print(f'{count} concurrent tasks in {elapsed:.3f}s, fetch_many: {items}')
+    if profile:
+        dump_profile()
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure the per-call tracing overhead')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile instead of trace the example class')
+    parser.add_argument('--tasks', type=int,
+                        help='run the async example with this many '
+                             'concurrent tasks')
+    parser.add_argument('--number', type=int, default=200_000,
+                        help='number of calls per benchmark run')
+
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark(args.number)
+        return
+
+    if args.tasks:
+        run_tasks(args.tasks, profile=args.profile)
+        return
+
+    enable()
+    sink = BufferedSink()
+    set_sink(sink)
+
+    @(profiled if args.profile else traced)
+    class FruitSalad:
+
+        def __init__(self):
+            self.fruits = {}
+
+        def add(self, fruit, weight):
+            if fruit not in self.fruits:
+                self.fruits[fruit] = weight
+            else:
+                self.fruits[fruit] += weight
+            return self.fruits[fruit]
+
+    fruit_salad = FruitSalad()
+    fruit_salad.add('apple', 500)
+    fruit_salad.add('orange', 800)
+    sink.close()
+    if args.profile:
+        for i in range(10_000):
+            fruit_salad.add('banana', i)
+        dump_profile()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""check_palindromes_fast.py
+
+Palindrome checks for huge word lists and very long strings, in addition to
+the ones of check_palindromes.py:
+
+- is_palindrome_two_pointers(): compares characters from both ends towards
+  the middle, every pair only once, stops at the first mismatch and doesn't
+  copy the text.
+- is_palindrome_blocks(): the same, but on blocks of characters compared
+  with slicing, so it mostly runs in C while copying only two blocks at a
+  time.
+- is_palindrome_buffer(): block-wise check of bytes-like ASCII data (bytes,
+  bytearray, memoryview, mmap), without decoding it to a str first.
+  is_palindrome_file() checks a whole (memory mapped) file that way.
+- check_file(): checks a file of candidates line by line, optionally in a
+  pool of worker processes.
+"""
+
+import collections
+import itertools
+import mmap
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from check_palindromes import (
+    is_palindrome, is_palindrome_ext_slicing, is_palindrome_loop)
+
+BLOCK_SIZE = 1 << 16
+
+
+def is_palindrome_two_pointers(text):
+    """Check if text is a palindrome comparing characters from both ends.
+    """
+    left = 0
+    right = len(text) - 1
+    while left < right:
+        if text[left] != text[right]:
+            return False
+        left += 1
+        right -= 1
+    return True
+
+
+def is_palindrome_blocks(text, block_size=BLOCK_SIZE):
+    """Check if text is a palindrome comparing blocks of block_size
+    characters from both ends.
+    """
+    left = 0
+    right = len(text)
+    while right - left >= 2 * block_size:
+        if (text[left:left + block_size]
+                != text[right - block_size:right][::-1]):
+            return False
+        left += block_size
+        right -= block_size
+    middle = text[left:right]
+    return middle == middle[::-1]
+
+
+def is_palindrome_buffer(data, block_size=BLOCK_SIZE):
+    """Check if the bytes-like data is a palindrome comparing blocks of
+    block_size bytes from both ends.
+
+    Bytes are compared, not characters, so this is only right for ASCII (or
+    other single byte encoded) text.
+    """
+    view = memoryview(data)
+    left = 0
+    right = len(view)
+    while right - left >= 2 * block_size:
+        if (view[left:left + block_size].tobytes()
+                != view[right - block_size:right].tobytes()[::-1]):
+            return False
+        left += block_size
+        right -= block_size
+    middle = view[left:right].tobytes()
+    return middle == middle[::-1]
+
+
+def is_palindrome_file(path, block_size=BLOCK_SIZE):
+    """Check if the content of the (ASCII) file path, without a final line
+    end, is a palindrome.
+    """
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return True
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = len(data)
+            if data[end - 1:end] == b'\n':
+                end -= 2 if data[end - 2:end] == b'\r\n' else 1
+            with memoryview(data) as view:
+                with view[:end] as content:
+                    return is_palindrome_buffer(content, block_size)
+
+
+def check_lines(lines, method=is_palindrome_blocks):
+    """Return the list of method results for the lines.
+    """
+    return [method(line) for line in lines]
+
+
+def check_file(path, method=is_palindrome_blocks, processes=None,
+               batch_size=10_000):
+    """Generator function yielding (line, is palindrome) tuples for the lines
+    (without line end) of the text file path.
+
+    With processes > 1, batches of batch_size lines are checked in a pool of
+    that many worker processes, at most two batches per process at a time so
+    that memory use doesn't grow with the size of the file.
+    """
+    with open(path) as fp:
+        lines = (line.rstrip('\r\n') for line in fp)
+        batches = iter(lambda: list(itertools.islice(lines, batch_size)), [])
+        if processes and processes > 1:
+            import multiprocessing
+            with multiprocessing.Pool(processes) as pool:
+                # (batch, AsyncResult) of the batches being checked
+                pending = collections.deque()
+                for batch in batches:
+                    result = pool.apply_async(check_lines, (batch, method))
+                    pending.append((batch, result))
+                    if len(pending) >= 2 * processes:
+                        (done, result) = pending.popleft()
+                        yield from zip(done, result.get())
+                while pending:
+                    (done, result) = pending.popleft()
+                    yield from zip(done, result.get())
+        else:
+            for batch in batches:
+                yield from zip(batch, check_lines(batch, method))
+
+
+def benchmark(sizes=(10, 1000, 1_000_000), words=1_000_000):
+    """Print the time per check of all variants for palindromes and
+    non-palindromes of sizes characters, and of check_file() for a file of
+    words.
+    """
+    methods = [is_palindrome, is_palindrome_ext_slicing, is_palindrome_loop,
+               is_palindrome_two_pointers, is_palindrome_blocks,
+               is_palindrome_buffer]
+    for size in sizes:
+        half = ('abcdefghij' * (size // 20 + 1))[:size // 2]
+        palindrome = half + half[::-1]
+        cases = [('palindrome', palindrome),
+                 ('mismatch at the ends', 'x' + palindrome[1:]),
+                 ('mismatch in the middle',
+                  half[:-1] + 'xy' + half[-1::-1][1:])]
+        for (case, text) in cases:
+            print(f'{len(text)} characters, {case}:')
+            for method in methods:
+                arg = (text.encode('ascii') if method is is_palindrome_buffer
+                       else text)
+                timer = timeit.Timer(lambda: method(arg))
+                (number, elapsed) = timer.autorange()
+                print(f'{method.__name__:>30}: '
+                      f'{elapsed / number * 1e6:12.3f} us')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'words.txt')
+        with open(path, 'w') as fp:
+            for i in range(words):
+                word = f'{i:x}'
+                fp.write(f'{word}{word[::-1]}\n' if i % 2 else f'{word}\n')
+        for processes in sorted({1, 2, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            count = sum(result for (_, result)
+                        in check_file(path, processes=processes))
+            elapsed = time.perf_counter() - start
+            print(f'check_file() of {words} words with {processes} '
+                  f'process(es): {count} palindromes in {elapsed:.3f}s')
+
+
+def parse_args(args=None):
+    """Parse arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'texts', nargs='*',
+        help='One or more palindrome candidate texts')
+    parser.add_argument(
+        '--file',
+        help='File of palindrome candidates, one per line')
+    parser.add_argument(
+        '--processes', type=int,
+        help='Number of worker processes checking --file')
+    parser.add_argument(
+        '--benchmark', action='store_true',
+        help='Compare the speed of all variants')
+    args = parser.parse_args(args)
+    return args
+
+
+def main(args=None):
+    """Main module function.
+
+    Parses arguments from sys.argv if args is None (the default) or from args
+    sequence otherwise.
+    """
+    args = parse_args(args)
+    if args.benchmark:
+        benchmark()
+        return
+
+    if args.file:
+        count = 0
+        for (line, result) in check_file(args.file, processes=args.processes):
+            if result:
+                count += 1
+                print(line)
+        print(f'{count} palindromes')
+        return
+
+    for text in args.texts or [input("text: ")]:
+        for method in [
+                is_palindrome_two_pointers,
+                is_palindrome_blocks,
+                ]:
+            print(f'{method.__name__}("{text}") --> {method(text)}')
+        print(f'is_palindrome_buffer(b"{text}") --> '
+              f'{is_palindrome_buffer(text.encode())}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
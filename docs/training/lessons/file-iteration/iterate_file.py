@@ -14,6 +14,11 @@ def main(args):
     else:
         input_file = args.input_file
 
+    if args.input_separator:
+        in_separator = args.input_separator
+    else:
+        in_separator = ","
+
     with open(input_file) as my_input_file:
         if args.output_file:
             if args.output_separator:
@@ -21,14 +26,14 @@ def main(args):
             else:
                 out_separator = "\n"
             with open(args.output_file, 'w') as my_output_file:
-                # readlines(): Read the whole file at once 
-                #              returns a list of lines
-                for line in gen(my_input_file.readlines()):
+                # Iterating over the file object reads it line by line,
+                # so the whole file never needs to fit into memory
+                for line in gen(my_input_file, in_separator):
                     # rstrip(): removes trailing whitespaces and newlines
                     my_output_file.write(line.rstrip()+ out_separator)
         else:
             # No output_file given, so just print to stdout
-            for line in gen(my_input_file.readlines()):
+            for line in gen(my_input_file, in_separator):
                 # rstrip(): removes trailing whitespaces and newlines
                 print(line.rstrip())
 
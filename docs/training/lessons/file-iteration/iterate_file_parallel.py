@@ -0,0 +1,200 @@
+""" iterate_file_parallel
+
+Parallel variant of iterate_file_stream.py: splits many input files (given as
+file paths, directories or glob patterns) in a pool of worker processes,
+either into one output file per input file or merged into a single output
+file, in input order or in order of completion.
+
+A single large input file can also be split into byte-range shards that are
+processed in parallel. Shard boundaries are moved to the next line end, so a
+separator never straddles two shards.
+"""
+import argparse
+import concurrent.futures
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+from iterate_file_stream import CHUNK_SIZE, write_fields
+
+
+def expand_inputs(patterns):
+    """Return the sorted list of files matching the file paths, directories
+    (all files directly inside) and glob patterns.
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        files.update(path for path in glob.glob(pattern)
+                     if os.path.isfile(path))
+    return sorted(files)
+
+
+def shard_ranges(input_file, shards):
+    """Return a list of (start, end) byte ranges splitting input_file into
+    (at most) shards parts, each starting at the beginning of a line.
+    """
+    size = os.path.getsize(input_file)
+    starts = [0]
+    with open(input_file, 'rb') as fp:
+        for i in range(1, shards):
+            # Move the nominal offset to the start of the next line.
+            fp.seek(max(size * i // shards - 1, starts[-1]))
+            fp.readline()
+            starts.append(min(fp.tell(), size))
+    starts.append(size)
+    return [(start, end) for (start, end) in zip(starts, starts[1:])
+            if start < end]
+
+
+class FileRange:
+    """Read-only binary file object restricted to a byte range of a file.
+    """
+
+    def __init__(self, fp, start, end):
+        self.fp = fp
+        self.remaining = end - start
+        fp.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def split_range(input_file, output_file, start=0, end=None,
+                in_separator=',', out_separator='\n', chunk_size=CHUNK_SIZE,
+                encoding='utf-8'):
+    """Split the byte range [start, end) of input_file (the whole file if end
+    is None) and write the fields to output_file.
+
+    Runs in the worker processes, returns output_file.
+    """
+    if end is None:
+        end = os.path.getsize(input_file)
+    in_sep = in_separator.encode(encoding)
+    out_sep = out_separator.encode(encoding)
+    with open(input_file, 'rb') as my_input_file, \
+            open(output_file, 'wb', buffering=chunk_size) as my_output_file:
+        write_fields(FileRange(my_input_file, start, end), my_output_file,
+                     in_sep, out_sep, chunk_size)
+    return output_file
+
+
+def split_parallel(input_files, output_file=None, output_dir=None,
+                   workers=None, shards=1, ordered=True, **kwargs):
+    """Split the input_files in worker processes.
+
+    With output_dir, each input file gets its own output file of the same
+    name in output_dir. Otherwise all output is merged into output_file (or
+    stdout if output_file is None), in input order if ordered is true or as
+    the single jobs complete otherwise.
+
+    If shards > 1 each input file is split into that many byte-range shards
+    processed in parallel. Further keyword arguments are passed on to
+    split_range().
+
+    Raises ValueError if an output file would overwrite an input file or the
+    output of another input file of the same name.
+    """
+    if output_dir:
+        if shards > 1:
+            raise ValueError('Sharding needs a merged output file')
+        output_files = [os.path.join(output_dir, os.path.basename(input_file))
+                        for input_file in input_files]
+    else:
+        output_files = [output_file] if output_file else []
+    inputs = {os.path.realpath(input_file): input_file
+              for input_file in input_files}
+    outputs = {}
+    for (input_file, my_output_file) in zip(input_files, output_files):
+        path = os.path.realpath(my_output_file)
+        if path in inputs:
+            raise ValueError(f'Output file {my_output_file} would overwrite '
+                             f'input file {inputs[path]}')
+        if path in outputs:
+            raise ValueError(f'Input files {outputs[path]} and {input_file} '
+                             f'would both be written to {my_output_file}')
+        outputs[path] = input_file
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = []
+        for (index, input_file) in enumerate(input_files):
+            if output_dir:
+                futures.append(executor.submit(
+                    split_range, input_file, output_files[index], **kwargs))
+                continue
+            for (start, end) in shard_ranges(input_file, shards):
+                part_file = os.path.join(tmp_dir, str(len(futures)))
+                futures.append(executor.submit(
+                    split_range, input_file, part_file, start, end,
+                    **kwargs))
+
+        if ordered:
+            done = (future.result() for future in futures)
+        else:
+            done = (future.result()
+                    for future in concurrent.futures.as_completed(futures))
+        if output_dir:
+            for _ in done:
+                pass
+            return
+
+        if output_file:
+            my_output_file = open(output_file, 'wb')
+        else:
+            sys.stdout.flush()
+            my_output_file = open(sys.stdout.fileno(), 'wb', closefd=False)
+        with my_output_file:
+            for part_file in done:
+                with open(part_file, 'rb') as part:
+                    shutil.copyfileobj(part, my_output_file)
+                os.remove(part_file)
+
+
+def main(args):
+    input_files = expand_inputs(args.input_file)
+    if not input_files:
+        sys.exit(f'No input files found for {args.input_file}')
+
+    try:
+        split_parallel(
+            input_files, output_file=args.output_file,
+            output_dir=args.output_dir, workers=args.workers,
+            shards=args.shards, ordered=not args.unordered,
+            in_separator=args.input_separator or ',',
+            out_separator=args.output_separator or '\n',
+            chunk_size=args.chunk_size)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_file', nargs='+', required=True,
+                        help='Paths, directories or glob patterns of files')
+    parser.add_argument('--input_separator', help='line separator of input file')
+    parser.add_argument('--output_file', help='Path to merged output file')
+    parser.add_argument('--output_dir',
+                        help='Directory for one output file per input file')
+    parser.add_argument('--output_separator', help='line separator of output file')
+    parser.add_argument('--workers', type=int,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='split each input file into byte-range shards')
+    parser.add_argument('--unordered', action='store_true',
+                        help='merge output in order of completion')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE,
+                        help='number of bytes read and buffered at a time')
+
+    args = parser.parse_args()
+
+    main(args)
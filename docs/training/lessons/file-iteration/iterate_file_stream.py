@@ -0,0 +1,263 @@
+""" iterate_file_stream
+
+Streaming variant of iterate_file.py: reads the input file in fixed-size
+binary chunks, splits on an arbitrary (multi-byte) separator - also across
+chunk boundaries - and writes through a buffered writer. Memory use is bounded
+by the chunk size plus the longest field, regardless of the file size.
+
+Alternatively the input file can be memory-mapped, yielding fields as
+zero-copy memoryview slices of the mapped file that only get decoded when
+actually needed (see mapped() and mmap_fields()), and written to the output
+file straight from the mapped buffer. This keeps allocations per field near
+zero, but as fields are then found in Python rather than by bytes.split() it
+is slower than the chunked stream when every field gets written anyway.
+
+Line ends are '\n' or '\r\n'.
+"""
+import argparse
+import contextlib
+import io
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+CHUNK_SIZE = 1024 * 1024
+WHITESPACE = frozenset(b' \t\n\r\x0b\x0c')
+
+
+def split_chunks(fp, separator=b',', chunk_size=CHUNK_SIZE):
+    """Generator function yielding lists of the bytes fields of the binary
+    file object fp, one list per chunk read.
+
+    Like iterate_file.gen() line ends also separate fields.
+    """
+    if not separator or b'\n' in separator:
+        raise ValueError(f'Invalid separator {separator!r}')
+    # Unfinished data from the previous chunk and whether it already is a
+    # field on its own (i.e. it follows a separator).
+    tail = b''
+    pending = False
+    while chunk := fp.read(chunk_size):
+        buf = tail + chunk
+        # Only split up to the last complete line end or separator, the rest
+        # (maybe the start of a multi-byte separator) continues in the next
+        # chunk.
+        cut = buf.rfind(b'\n')
+        if cut >= 0:
+            (tail, pending) = (buf[cut + 1:], False)
+            yield [field for line in buf[:cut].split(b'\n')
+                   for field in line.split(separator)]
+        else:
+            # A line longer than the chunk size: its last field may still
+            # continue.
+            fields = buf.split(separator)
+            tail = fields.pop()
+            if fields:
+                pending = True
+                yield fields
+    if tail or pending:
+        yield tail.split(separator)
+
+
+def split_stream(fp, separator=b',', chunk_size=CHUNK_SIZE):
+    """Generator function yielding the bytes fields of the binary file object
+    fp, split by separator and line ends.
+    """
+    for fields in split_chunks(fp, separator, chunk_size):
+        yield from fields
+
+
+@contextlib.contextmanager
+def mapped(input_file):
+    """Context manager memory-mapping input_file read-only.
+
+    Fields sliced from the map must not be kept beyond the with block (copy
+    them with bytes() if needed), the map can't be closed otherwise.
+    """
+    with open(input_file, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            # Empty files can't be mapped.
+            yield b''
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def mmap_offsets(buf, separator=b','):
+    """Generator function yielding the (start, end) offsets of the fields in
+    buf (a mmap or bytes object), split by separator and line ends.
+
+    Fields aren't copied, and every separator and line end is only searched
+    for once.
+    """
+    if not separator or b'\n' in separator:
+        raise ValueError(f'Invalid separator {separator!r}')
+    size = len(buf)
+    sep_len = len(separator)
+    find = buf.find
+    pos = 0
+    next_sep = find(separator)
+    next_nl = find(b'\n')
+    # Whether the data at pos is a field even if empty, i.e. follows a
+    # separator.
+    pending = False
+    while pos < size or pending:
+        if 0 <= next_nl < pos:
+            next_nl = find(b'\n', pos)
+        if 0 <= next_sep < pos:
+            next_sep = find(separator, pos)
+        line_end = size if next_nl < 0 else next_nl
+        if 0 <= next_sep < line_end:
+            yield (pos, next_sep)
+            (pos, pending) = (next_sep + sep_len, True)
+        else:
+            yield (pos, line_end)
+            (pos, pending) = (line_end + 1, False)
+
+
+def mmap_fields(buf, separator=b','):
+    """Generator function yielding the fields in buf (a mmap or bytes object)
+    as zero-copy memoryview slices, split by separator and line ends.
+
+    Use e.g. str(field, 'utf-8') to decode a field.
+    """
+    with memoryview(buf) as view:
+        for (start, end) in mmap_offsets(buf, separator):
+            yield view[start:end]
+
+
+def mmap_split(input_file, output_file=None, in_separator=',',
+               out_separator='\n', chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    """Split the memory-mapped input_file and write the fields separated by
+    out_separator to output_file (or stdout if output_file is None), straight
+    from the mapped buffer.
+    """
+    in_sep = in_separator.encode(encoding)
+    out_sep = out_separator.encode(encoding)
+    with mapped(input_file) as mm:
+        if output_file:
+            my_output_file = open(output_file, 'wb', buffering=chunk_size)
+        else:
+            sys.stdout.flush()
+            my_output_file = io.BufferedWriter(
+                io.FileIO(sys.stdout.fileno(), 'wb', closefd=False),
+                buffer_size=chunk_size)
+        with my_output_file, memoryview(mm) as view:
+            write = my_output_file.write
+            for (start, end) in mmap_offsets(mm, in_sep):
+                # Like rstrip() but without copying the field.
+                while end > start and mm[end - 1] in WHITESPACE:
+                    end -= 1
+                write(view[start:end])
+                write(out_sep)
+
+
+def write_fields(input_fp, output_fp, in_sep=b',', out_sep=b'\n',
+                 chunk_size=CHUNK_SIZE):
+    """Split the binary file object input_fp and write the fields separated by
+    out_sep to the binary file object output_fp.
+    """
+    for fields in split_chunks(input_fp, in_sep, chunk_size):
+        # rstrip(): removes trailing whitespaces and \r line end
+        # remainders, like iterate_file.py
+        fields = [field.rstrip() for field in fields]
+        fields.append(b'')
+        output_fp.write(out_sep.join(fields))
+
+
+def stream(input_file, output_file=None, in_separator=',',
+           out_separator='\n', chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    """Split input_file and write the fields separated by out_separator to
+    output_file (or stdout if output_file is None).
+    """
+    in_sep = in_separator.encode(encoding)
+    out_sep = out_separator.encode(encoding)
+    with open(input_file, 'rb') as my_input_file:
+        if output_file:
+            my_output_file = open(output_file, 'wb', buffering=chunk_size)
+        else:
+            sys.stdout.flush()
+            my_output_file = io.BufferedWriter(
+                io.FileIO(sys.stdout.fileno(), 'wb', closefd=False),
+                buffer_size=chunk_size)
+        with my_output_file:
+            write_fields(my_input_file, my_output_file, in_sep, out_sep,
+                         chunk_size)
+
+
+def readlines_split(input_file, output_file, in_separator=',',
+                    out_separator='\n'):
+    """The original iterate_file.py approach: read all lines at once, then
+    split them (for comparison in the benchmark).
+    """
+    from iterate_file import gen
+    with open(input_file) as my_input_file:
+        with open(output_file, 'w') as my_output_file:
+            for line in gen(my_input_file.readlines(), in_separator):
+                my_output_file.write(line.rstrip() + out_separator)
+
+
+def benchmark(size_mb=100, chunk_size=CHUNK_SIZE):
+    """Print the throughput (MB/s) of readlines_split(), stream() and
+    mmap_split() on a generated comma-separated file of about size_mb
+    megabytes.
+    """
+    line = ','.join(f'Line {i}: Some text' for i in range(1, 11)) + '\n'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'in.txt')
+        output_file = os.path.join(tmp_dir, 'out.txt')
+        with open(input_file, 'w') as f:
+            for _ in range(size_mb * 1024 * 1024 // len(line)):
+                f.write(line)
+        size = os.path.getsize(input_file) / (1024 * 1024)
+
+        for (name, func, kwargs) in [
+                ('readlines', readlines_split, {}),
+                ('stream', stream, {'chunk_size': chunk_size}),
+                ('mmap', mmap_split, {'chunk_size': chunk_size}),
+                ]:
+            start = time.perf_counter()
+            func(input_file, output_file, **kwargs)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>10}: {size:.1f} MB in {elapsed:.3f}s '
+                  f'= {size / elapsed:.1f} MB/s')
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark_size, args.chunk_size)
+        return
+
+    if not args.input_file: # optional-argument
+        input_file = input("input_file: ")
+    else:
+        input_file = args.input_file
+
+    engine = mmap_split if args.engine == 'mmap' else stream
+    engine(input_file, args.output_file,
+           in_separator=args.input_separator or ',',
+           out_separator=args.output_separator or '\n',
+           chunk_size=args.chunk_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_file', help='Path to file"')
+    parser.add_argument('--input_separator', help='line separator of input file')
+    parser.add_argument('--output_file', help='Path to file"')
+    parser.add_argument('--output_separator', help='line separator of output file')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE,
+                        help='number of bytes read and buffered at a time')
+    parser.add_argument('--engine', choices=['stream', 'mmap'],
+                        default='stream',
+                        help='read the input in chunks or memory-map it')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare throughput against iterate_file.py')
+    parser.add_argument('--benchmark_size', type=int, default=100,
+                        help='size of the generated benchmark file in MB')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,87 @@
+"""Compare the run times of the file type classification functions of
+rewrite_dict_comprehension.py.
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import timeit
+
+from rewrite_dict_comprehension import (
+    dict_comp_filetypes_cwd, dict_comp_filetypes, for_loop_filetypes,
+    scandir_filetypes)
+
+
+@contextlib.contextmanager
+def chdir(path):
+    """Temporarily change the current working directory to path.
+    """
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def create_test_dir(path, entries):
+    """Create a directory with entries files, directories and symbolic links
+    (in a 8:1:1 ratio) in path.
+    """
+    for i in range(entries):
+        entry = os.path.join(path, f'entry{i}')
+        if i % 10 == 8:
+            os.mkdir(entry)
+        elif i % 10 == 9 and hasattr(os, 'symlink'):
+            os.symlink(f'entry{i - 1}', entry)
+        else:
+            with open(entry, 'w'):
+                pass
+
+
+def benchmark(path, number=10):
+    """Print the best run time per call of each file type function for path.
+    """
+    funcs = [
+        (dict_comp_filetypes_cwd, ()),
+        (dict_comp_filetypes, ('.',)),
+        (for_loop_filetypes, ('.',)),
+        (scandir_filetypes, ('.',)),
+        ]
+    with chdir(path):
+        results = {func.__name__: func(*args) for (func, args) in funcs}
+        expected = results['scandir_filetypes']
+        for (func, args) in funcs:
+            result = results[func.__name__]
+            if func is dict_comp_filetypes_cwd:
+                result = {os.path.join('.', entry): file_type
+                          for (entry, file_type) in result.items()}
+            assert result == expected, f'{func.__name__} result differs'
+            best = min(timeit.repeat(
+                lambda: func(*args), number=number, repeat=3)) / number
+            print(f'{func.__name__:>25}: {len(expected)} entries in '
+                  f'{best * 1000:8.2f}ms')
+
+
+def main(args):
+    if args.path:
+        benchmark(args.path, args.number)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            create_test_dir(tmp_dir, args.entries)
+            benchmark(tmp_dir, args.number)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path',
+                        help='directory to classify (default: a generated '
+                             'temporary test directory)')
+    parser.add_argument('--entries', type=int, default=10_000,
+                        help='number of entries in the generated directory')
+    parser.add_argument('--number', type=int, default=10,
+                        help='number of calls per timing run')
+
+    args = parser.parse_args()
+
+    main(args)
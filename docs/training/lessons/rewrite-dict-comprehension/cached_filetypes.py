@@ -0,0 +1,127 @@
+"""File type classification with a persistent on-disk cache.
+
+Adding, removing or renaming an entry changes the modification time of its
+directory, so a directory whose device, inode and mtime are unchanged since
+the last scan still has the same entries: its {<path entry>: <file type>}
+dictionary is then read from a SQLite cache file instead of reading the
+directory again. Only modified directories get rescanned.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from walk_filetypes import entry_filetype
+
+# Directories modified less than this many seconds ago aren't cached: a change
+# within the filesystem's timestamp granularity wouldn't alter the mtime.
+RACY_SECONDS = 2
+
+
+class FiletypeCache:
+    """Persistent cache of directory file type classifications.
+
+    Counts cache hits and misses (directories answered from the cache or
+    rescanned) and the number of entries answered from the cache.
+    """
+
+    def __init__(self, cache_file='filetypes.sqlite'):
+        self.connection = sqlite3.connect(cache_file)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS dirs ('
+            ' path TEXT PRIMARY KEY,'
+            ' dev INTEGER, ino INTEGER, mtime_ns INTEGER,'
+            ' entries TEXT)')
+        self.hits = 0
+        self.misses = 0
+        self.cached_entries = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def stats(self):
+        """Return the cache counters as a dict.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'cached_entries': self.cached_entries}
+
+    def filetypes(self, path='.'):
+        """Return a {<path entry>: <file type} dictionary of the given path,
+        like rewrite_dict_comprehension.scandir_filetypes().
+        """
+        return dict(self._entries(path))
+
+    def walk_filetypes(self, path='.', max_depth=None):
+        """Generator function yielding (<path>, <file type>) tuples for all
+        entries in the directory tree below path, like
+        walk_filetypes.walk_filetypes().
+        """
+        todo = [(path, 0)]
+        while todo:
+            (dir_path, depth) = todo.pop()
+            for (file_path, file_type) in self._entries(dir_path):
+                yield (file_path, file_type)
+                if file_type == 'dir' and (
+                        max_depth is None or depth < max_depth):
+                    todo.append((file_path, depth + 1))
+
+    def _entries(self, path):
+        """Return the list of (<path>, <file type>) tuples of the entries of
+        directory path, from the cache if the directory is unchanged.
+        """
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        row = self.connection.execute(
+            'SELECT dev, ino, mtime_ns, entries FROM dirs WHERE path = ?',
+            (key,)).fetchone()
+        if row is not None and row[:3] == (st.st_dev, st.st_ino,
+                                           st.st_mtime_ns):
+            self.hits += 1
+            entries = json.loads(row[3])
+            self.cached_entries += len(entries)
+        else:
+            self.misses += 1
+            with os.scandir(path) as dir_entries:
+                entries = [(entry.name, entry_filetype(entry))
+                           for entry in dir_entries]
+            if time.time_ns() - st.st_mtime_ns > RACY_SECONDS * 10**9:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)',
+                    (key, st.st_dev, st.st_ino, st.st_mtime_ns,
+                     json.dumps(entries)))
+        return [(os.path.join(path, name), file_type)
+                for (name, file_type) in entries]
+
+
+def main(args):
+    with FiletypeCache(args.cache_file) as cache:
+        for _ in range(args.repeat):
+            if args.recursive:
+                results = list(cache.walk_filetypes(args.path))
+            else:
+                results = cache.filetypes(args.path)
+            print(f'{len(results)} entries, cache stats: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default='./test_dir',
+                        help='directory to classify')
+    parser.add_argument('--cache_file', default='filetypes.sqlite',
+                        help='Path to the SQLite cache file')
+    parser.add_argument('--recursive', action='store_true',
+                        help='classify the whole directory tree')
+    parser.add_argument('--repeat', type=int, default=2,
+                        help='number of scans (to see the cache at work)')
+
+    args = parser.parse_args()
+
+    main(args)
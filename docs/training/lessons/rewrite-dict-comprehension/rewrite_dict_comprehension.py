@@ -73,12 +73,31 @@ def for_loop_filetypes(path='.'):
         elif os.path.isfile(file_path):
             file_type = 'file'
         else:
-            file_typ = 'other'
+            file_type = 'other'
         dct[file_path] = file_type
 
     return dct
 
 
+def scandir_filetypes(path='.'):
+    """Return a {<path entry>: <file type} dictionary of the given path.
+
+    Uses os.scandir(), whose DirEntry objects cache the file type information
+    returned when reading the directory: on most filesystems this needs no
+    extra stat() system call per entry.
+    """
+    with os.scandir(path) as entries:
+        dct = {
+            entry.path:
+                'link' if entry.is_symlink() else
+                'dir' if entry.is_dir() else
+                'file' if entry.is_file() else
+                'other'
+            for entry in entries
+            }
+    return dct
+
+
 def main(path):
     func = dict_comp_filetypes_cwd
     print(f'\n*** dict comprehension using {func.__name__}')
@@ -95,6 +114,11 @@ def main(path):
     dct = func(path)
     pprint.pprint(dct)
 
+    func = scandir_filetypes
+    print(f'\n*** dict comprehension using {func.__name__}(path={path})')
+    dct = func(path)
+    pprint.pprint(dct)
+
 
 if __name__ == '__main__':
     main(path='./test_dir')
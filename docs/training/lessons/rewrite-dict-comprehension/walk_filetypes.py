@@ -0,0 +1,127 @@
+"""Recursively classify the file types of a directory tree.
+
+Unlike the functions in rewrite_dict_comprehension.py, which build one dict
+for a single directory level, walk_filetypes() is a generator yielding
+(<path>, <file type>) tuples as soon as a directory has been read, so
+multi-million entry trees can be processed without holding all results in
+memory. Subdirectories can be read by a pool of threads: the system calls
+release the GIL, so on slow (e.g. network) filesystems they run concurrently.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+
+
+def entry_filetype(entry):
+    """Return the file type ('link', 'dir', 'file' or 'other') of a
+    os.DirEntry.
+    """
+    return (
+        'link' if entry.is_symlink() else
+        'dir' if entry.is_dir() else
+        'file' if entry.is_file() else
+        'other'
+        )
+
+
+def scan_dir(path, onerror=None):
+    """Return the list of (<path>, <file type>) tuples of the entries of
+    directory path and the list of its subdirectories.
+
+    Symbolic links to directories are not treated as subdirectories. Errors
+    are passed to onerror if given and ignored otherwise, like os.walk() does.
+    """
+    results = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                file_type = entry_filetype(entry)
+                results.append((entry.path, file_type))
+                if file_type == 'dir':
+                    subdirs.append(entry.path)
+    except OSError as exc:
+        if onerror is not None:
+            onerror(exc)
+    return (results, subdirs)
+
+
+def walk_filetypes(path='.', max_depth=None, workers=None, onerror=None):
+    """Generator function yielding (<path>, <file type>) tuples for all
+    entries in the directory tree below path.
+
+    max_depth limits the number of subdirectory levels to descend into (0
+    only classifies the entries of path itself, None means no limit).
+    With workers > 1 that many directories are read concurrently by a thread
+    pool and results are yielded in order of completion.
+    """
+    # Directories still to read, with their depth.
+    todo = collections.deque([(path, 0)])
+
+    def descend(subdirs, depth):
+        if max_depth is None or depth < max_depth:
+            todo.extend((subdir, depth + 1) for subdir in subdirs)
+
+    if not workers or workers <= 1:
+        while todo:
+            (dir_path, depth) = todo.pop()
+            (results, subdirs) = scan_dir(dir_path, onerror)
+            yield from results
+            descend(subdirs, depth)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = {}
+        while todo or pending:
+            # Only keep a bounded number of directory reads in flight, the
+            # rest waits (as plain paths) in todo.
+            while todo and len(pending) < 2 * workers:
+                (dir_path, depth) = todo.pop()
+                future = executor.submit(scan_dir, dir_path, onerror)
+                pending[future] = depth
+            (done, _) = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                depth = pending.pop(future)
+                (results, subdirs) = future.result()
+                yield from results
+                descend(subdirs, depth)
+
+
+def write_json_lines(results, fp):
+    """Write (<path>, <file type>) results to the text file object fp as JSON
+    lines, i.e. one {"path": ..., "type": ...} JSON object per line.
+    """
+    for (file_path, file_type) in results:
+        fp.write(json.dumps({'path': file_path, 'type': file_type}))
+        fp.write('\n')
+
+
+def main(args):
+    results = walk_filetypes(
+        args.path, max_depth=args.max_depth, workers=args.workers,
+        onerror=lambda exc: print(exc, file=sys.stderr))
+    if args.output_file:
+        with open(args.output_file, 'w') as my_output_file:
+            write_json_lines(results, my_output_file)
+    else:
+        write_json_lines(results, sys.stdout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default='.',
+                        help='root directory of the tree to classify')
+    parser.add_argument('--max_depth', type=int,
+                        help='maximum number of subdirectory levels')
+    parser.add_argument('--workers', type=int,
+                        help='number of threads reading directories')
+    parser.add_argument('--output_file',
+                        help='Path to JSON lines output file (default: stdout)')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,138 @@
+""" fake_smtp
+
+Local stand-in SMTP server to try out and benchmark the sendmail scripts
+without a real mail-server: accepts every message, counts them and throws
+them away (or keeps them for inspection with keep=True).
+
+It can simulate a slow server (delay seconds per message), dropped sessions
+(closing the connection after accepting drop_after messages, so a client
+retrying on a new connection doesn't deliver a message twice) and transient
+failures (rejecting every fail_every-th message with '451 Try again later').
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server.fake_smtp
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost fake SMTP')
+        messages = 0
+        while line := self.rfile.readline():
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command in (b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                chunks = [] if server.keep else None
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    size += len(line)
+                    if chunks is not None:
+                        chunks.append(line)
+                if server.delay:
+                    time.sleep(server.delay)
+                with server.lock:
+                    server.attempts += 1
+                    failed = (server.fail_every
+                              and not server.attempts % server.fail_every)
+                if failed:
+                    self.reply('451 Try again later')
+                    continue
+                with server.lock:
+                    server.messages += 1
+                    server.bytes += size
+                    if chunks is not None:
+                        server.received.append(b''.join(chunks))
+                self.reply('250 OK queued')
+                messages += 1
+                if server.drop_after and messages >= server.drop_after:
+                    # Drop the session, like an idle timeout of the server:
+                    # the client notices with its next command.
+                    return
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSMTPServer:
+    ''' SMTP server running in a background thread, use as context manager '''
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0, drop_after=None,
+                 fail_every=None, keep=False):
+        self.delay = delay
+        self.drop_after = drop_after
+        self.fail_every = fail_every
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.attempts = 0
+        self.messages = 0
+        self.bytes = 0
+        self.received = []
+        self._server = _ThreadingTCPServer((host, port), _SMTPHandler)
+        self._server.fake_smtp = self
+        (self.host, self.port) = self._server.server_address[:2]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(args):
+    server = FakeSMTPServer(args.host, args.port, delay=args.delay,
+                            drop_after=args.drop_after,
+                            fail_every=args.fail_every)
+    print(f'fake SMTP server listening on {server.host}:{server.port}')
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f'{server.messages} messages ({server.bytes} bytes) on '
+          f'{server.connections} connections')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8025, help='port to listen on')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='seconds to take per message')
+    parser.add_argument('--drop_after', type=int,
+                        help='drop sessions after this number of messages')
+    parser.add_argument('--fail_every', type=int,
+                        help='reject every n-th message as a transient failure')
+
+    args = parser.parse_args()
+
+    main(args)
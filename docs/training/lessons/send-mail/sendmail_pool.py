@@ -0,0 +1,252 @@
+""" sendmail_pool
+
+Pooled variant of the MailServer class of sendmail.py for bursts of mails.
+MailServer opens one connection and sends one message at a time over it,
+with no way to recover from a dropped session. A MailPool instead keeps up to
+size reusable connections:
+
+- connections are opened on demand and reused, idle ones are checked with
+  NOOP before reuse and replaced if the server dropped them
+- a message failing on a dropped session is sent again on a new connection
+  (which may, rarely, deliver it twice)
+- send_many() spreads a stream of messages over all connections of the pool
+
+Try it with the local stand-in server of fake_smtp.py: --fake, --benchmark.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import os
+import queue
+import smtplib
+import threading
+import time
+
+from fake_smtp import FakeSMTPServer
+
+# Errors leaving a connection unusable
+DISCONNECTED = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class MailPool:
+    ''' pool of reusable SMTP connections to smtp_host '''
+
+    def __init__(self, smtp_host, port=0, size=4, timeout=30, check_after=10.0,
+                 retries=1):
+        self.smtp_host = smtp_host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.retries = retries
+        self.connects = 0
+        self.reconnects = 0
+        # (connection, time of last use), most recently used first
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.smtp_host, self.port,
+                                  timeout=self.timeout)
+        with self._lock:
+            self.connects += 1
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    @staticmethod
+    def is_healthy(connection):
+        ''' check connection with a NOOP command '''
+        try:
+            return connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def acquire(self, fresh=False):
+        ''' return an idle connection of the pool or a new one (always with
+            fresh), waiting while all size connections are in use '''
+        self._slots.acquire()
+        try:
+            if fresh:
+                return self._connect()
+            try:
+                (connection, last_used) = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if (time.monotonic() - last_used > self.check_after
+                    and not self.is_healthy(connection)):
+                connection.close()
+                with self._lock:
+                    self.reconnects += 1
+                return self._connect()
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        ''' give back a connection of acquire(), closing broken ones '''
+        if broken:
+            connection.close()
+        else:
+            self._idle.put((connection, time.monotonic()))
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def connection(self, fresh=False):
+        ''' context manager for a connection of the pool, see acquire() '''
+        connection = self.acquire(fresh)
+        try:
+            yield connection
+        except DISCONNECTED:
+            self.release(connection, broken=True)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def send_mail(self, sender, receivers, msg):
+        ''' send a pre-formatted message, return the refused receivers
+            like smtplib.SMTP.sendmail() '''
+        for attempt in range(self.retries + 1):
+            try:
+                # Retry on a new connection: the next idle one may have
+                # been dropped by the server as well.
+                with self.connection(fresh=attempt > 0) as connection:
+                    return connection.sendmail(sender, receivers, msg)
+            except DISCONNECTED:
+                if attempt == self.retries:
+                    raise
+                with self._lock:
+                    self.reconnects += 1
+
+    def send_many(self, messages):
+        ''' send the (sender, receivers, msg) tuples of the messages iterable
+            over all connections of the pool, return a dict
+            {index: exception} of the failed messages '''
+        messages = enumerate(messages)
+        lock = threading.Lock()
+        failures = {}
+
+        def work():
+            while True:
+                with lock:
+                    item = next(messages, None)
+                if item is None:
+                    return
+                (index, (sender, receivers, msg)) = item
+                try:
+                    refused = self.send_mail(sender, receivers, msg)
+                    if refused:
+                        raise smtplib.SMTPRecipientsRefused(refused)
+                except Exception as e:
+                    failures[index] = e
+
+        with concurrent.futures.ThreadPoolExecutor(self.size) as executor:
+            for future in [executor.submit(work) for _ in range(self.size)]:
+                future.result()
+        return failures
+
+    def close(self):
+        ''' quit all idle connections '''
+        while True:
+            try:
+                (connection, _) = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def test_messages(count, sender='test.test@foo.de', receiver='you@foo.de'):
+    for i in range(count):
+        msg = (f'From: From Person {sender}\nTo: {receiver}\n'
+               f'Subject: Python-Course Test SMTP-Email {i}\n\n'
+               f'This is test Email {i}.')
+        yield (sender, [receiver], msg)
+
+
+def benchmark(count=1000, delay=0.002, pool_sizes=(1, 2, 4, 8, 16)):
+    ''' print messages/second against a fake server taking delay seconds per
+        message, for one connection per message and for pooled connections '''
+    with FakeSMTPServer(delay=delay) as server:
+        start = time.perf_counter()
+        for (sender, receivers, msg) in test_messages(count // 10):
+            mail_server = smtplib.SMTP(server.host, server.port)
+            mail_server.sendmail(sender, receivers, msg)
+            mail_server.quit()
+        elapsed = time.perf_counter() - start
+        print(f'connection per message: {count // 10 / elapsed:8.0f} msgs/s')
+
+        for size in pool_sizes:
+            with MailPool(server.host, server.port, size=size) as pool:
+                start = time.perf_counter()
+                failures = pool.send_many(test_messages(count))
+                elapsed = time.perf_counter() - start
+            assert not failures, failures
+            print(f'pool of {size:2} connections: '
+                  f'{count / elapsed:8.0f} msgs/s')
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark_count, args.delay)
+        return
+
+    if args.fake:
+        # local stand-in server dropping every session after 3 messages
+        server = FakeSMTPServer(drop_after=3).start()
+        (SMTP_HOST, port) = (server.host, server.port)
+        domain_name = 'foo.de'
+    else:
+        SMTP_HOST = input("SMTP_HOST: ")
+        port = 0
+        domain_name = input("E-MAIL DOMAINNAME: ")
+
+    if os.name == 'nt':
+        user = os.environ['USERNAME']
+    elif os.name == 'posix':
+        user = os.environ['USER']
+
+    with MailPool(SMTP_HOST, port, size=args.pool_size) as pool:
+        failures = pool.send_many(
+            test_messages(args.count, receiver=f"{user}@{domain_name}"))
+    print(f'sent {args.count - len(failures)} of {args.count} messages '
+          f'on {pool.connects} connections, {pool.reconnects} reconnects')
+    for (index, error) in sorted(failures.items()):
+        print(f'ERROR: message {index}: {error}')
+    if args.fake:
+        print(f'server accepted {server.messages} messages')
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10, help='number of test messages')
+    parser.add_argument('--pool_size', type=int, default=4,
+                        help='number of connections')
+    parser.add_argument('--fake', action='store_true',
+                        help='send to a local stand-in server dropping sessions')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare throughput for several pool sizes')
+    parser.add_argument('--benchmark_count', type=int, default=1000,
+                        help='number of benchmark messages')
+    parser.add_argument('--delay', type=float, default=0.002,
+                        help='seconds the benchmark server takes per message')
+
+    args = parser.parse_args()
+
+    main(args)
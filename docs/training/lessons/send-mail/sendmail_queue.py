@@ -0,0 +1,531 @@
+""" sendmail_queue
+
+Background dispatch queues for mails: MailServer.send_mail() blocks its
+caller for the whole SMTP round trip, submit() of a dispatcher returns at
+once. Worker threads (ThreadDispatcher, on the connections of a MailPool of
+sendmail_pool.py) or asyncio tasks (AsyncDispatcher, with a minimal asyncio
+SMTP client) send the queued messages in batches, one batch per connection.
+
+- Transient failures (4xx replies, dropped sessions, connection errors) are
+  retried with exponential backoff, permanent ones (5xx replies) fail at once.
+- With a spool directory every submitted message is kept in it as a JSON file
+  until sent (failed ones get moved to its 'failed' subdirectory), and
+  messages left over by a previous run are sent first. Spool files aren't
+  fsynced: they survive crashes of the process, not of the machine.
+
+Try it with the local stand-in server of fake_smtp.py: --benchmark measures
+the submit latency and the drain throughput.
+"""
+import argparse
+import asyncio
+import collections
+import email.message
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+
+from fake_smtp import FakeSMTPServer
+from sendmail_pool import DISCONNECTED, MailPool, test_messages
+
+
+def is_transient(error):
+    ''' return whether sending may succeed when retried after error '''
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500
+                   for (code, _) in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPNotSupportedError):
+        # e.g. a non-ASCII address without SMTPUTF8 support of the server
+        return False
+    # dropped sessions, connection errors and timeouts
+    return isinstance(error, OSError)
+
+
+def message_bytes(msg):
+    ''' return the (str) message of a spooled item as bytes with CRLF line
+        ends, UTF-8 encoded '''
+    msg = msg.encode('utf-8', 'surrogateescape')
+    return re.sub(rb'\r\n|\n|\r', b'\r\n', msg)
+
+
+class Dispatcher:
+    ''' retry policy, spooling and statistics of the dispatchers '''
+
+    def __init__(self, spool_dir=None, batch_size=20, max_attempts=5,
+                 backoff=0.5, max_backoff=60.0):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.retries = 0
+        # (item, error) tuples of the messages given up on
+        self.failed = []
+        self._ids = itertools.count()
+        if spool_dir:
+            os.makedirs(os.path.join(spool_dir, 'failed'), exist_ok=True)
+
+    def _new_item(self, sender, receivers, msg):
+        if isinstance(msg, email.message.Message):
+            msg = msg.as_bytes()
+        if isinstance(msg, (bytes, bytearray)):
+            # str, to spool it as JSON, getting the same bytes back
+            msg = bytes(msg).decode('utf-8', 'surrogateescape')
+        item = {'id': f'{time.time_ns():016x}-{next(self._ids):08d}',
+                'sender': sender, 'receivers': list(receivers), 'msg': msg,
+                'attempts': 0}
+        self._spool(item)
+        return item
+
+    def _spool_path(self, item, *subdir):
+        return os.path.join(self.spool_dir, *subdir, f"{item['id']}.json")
+
+    def _spool(self, item):
+        if self.spool_dir:
+            path = self._spool_path(item)
+            with open(f'{path}.tmp', 'w') as fp:
+                json.dump(item, fp)
+            os.replace(f'{path}.tmp', path)
+
+    def _unspool(self, item):
+        if self.spool_dir:
+            os.remove(self._spool_path(item))
+
+    def _spooled(self):
+        ''' return the messages left in the spool directory, oldest first '''
+        if not self.spool_dir:
+            return []
+        items = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if name.endswith('.json'):
+                with open(os.path.join(self.spool_dir, name)) as fp:
+                    items.append(json.load(fp))
+        return items
+
+    def _outcome(self, item, error):
+        ''' record the outcome of an attempt to send item, return the delay
+            before retrying it or None if done with it '''
+        if error is None:
+            self.sent += 1
+            self._unspool(item)
+            return None
+        item['attempts'] += 1
+        if is_transient(error) and item['attempts'] < self.max_attempts:
+            self.retries += 1
+            # Persist the attempts and the receivers still to send to.
+            self._spool(item)
+            delay = min(self.backoff * 2 ** (item['attempts'] - 1),
+                        self.max_backoff)
+            # random jitter, not to retry all failed messages at once
+            return delay * random.uniform(0.5, 1.0)
+        self.failed.append((item, error))
+        if self.spool_dir:
+            os.replace(self._spool_path(item), self._spool_path(item, 'failed'))
+        return None
+
+
+def _result(item, refused):
+    ''' return the error of item after sendmail() refused some receivers,
+        sending only to those when retried '''
+    if not refused:
+        return None
+    item['receivers'] = list(refused)
+    return smtplib.SMTPRecipientsRefused(refused)
+
+
+class ThreadDispatcher(Dispatcher):
+    ''' dispatch queue sending with one worker thread per connection of pool '''
+
+    def __init__(self, pool, **options):
+        super().__init__(**options)
+        self.pool = pool
+        self._queue = collections.deque(self._spooled())
+        # (due time, sequence number, item) heap of messages to retry
+        self._retry = []
+        self._sequence = itertools.count()
+        # messages being sent
+        self._busy = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(pool.size)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, sender, receivers, msg):
+        ''' queue a pre-formatted message (str, bytes or EmailMessage) for
+            sending, return its id '''
+        if self._closed:
+            raise RuntimeError('dispatcher is closed')
+        item = self._new_item(sender, receivers, msg)
+        with self._cond:
+            if self._closed:
+                # closed meanwhile: not to be sent after a restart either
+                self._unspool(item)
+                raise RuntimeError('dispatcher is closed')
+            self._queue.append(item)
+            self._cond.notify()
+        return item['id']
+
+    @property
+    def pending(self):
+        return len(self._queue) + len(self._retry) + self._busy
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                now = time.monotonic()
+                while self._retry and self._retry[0][0] <= now:
+                    self._queue.append(heapq.heappop(self._retry)[2])
+                if self._queue:
+                    batch = [self._queue.popleft() for _ in
+                             range(min(self.batch_size, len(self._queue)))]
+                    self._busy += len(batch)
+                    return batch
+                self._cond.wait(self._retry[0][0] - now if self._retry
+                                else None)
+
+    def _send_batch(self, batch):
+        results = []
+        try:
+            with self.pool.connection() as connection:
+                for item in batch:
+                    try:
+                        refused = connection.sendmail(
+                            item['sender'], item['receivers'],
+                            message_bytes(item['msg']))
+                        results.append((item, _result(item, refused)))
+                    except (smtplib.SMTPResponseException,
+                            smtplib.SMTPRecipientsRefused) as e:
+                        results.append((item, e))
+                    except DISCONNECTED:
+                        raise
+                    except Exception as e:
+                        # e.g. a non-ASCII address: fails for good, but
+                        # mustn't kill the worker
+                        results.append((item, e))
+                        connection.rset()
+        except Exception as e:
+            # connecting failed or the session got dropped
+            results.extend((item, e) for item in batch[len(results):])
+        return results
+
+    def _run(self):
+        while (batch := self._next_batch()) is not None:
+            results = self._send_batch(batch)
+            with self._cond:
+                for (item, error) in results:
+                    delay = self._outcome(item, error)
+                    if delay is not None:
+                        heapq.heappush(self._retry, (time.monotonic() + delay,
+                                                     next(self._sequence),
+                                                     item))
+                self._busy -= len(results)
+                self._cond.notify_all()
+
+    def join(self, timeout=None):
+        ''' wait until all messages are sent or failed, return False on
+            timeout '''
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.pending, timeout)
+
+    def close(self, timeout=None):
+        ''' wait up to timeout seconds for the queued messages, then stop
+            the workers - unsent messages stay in the spool directory '''
+        self.join(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self.pool.close()
+
+
+class AsyncSMTP:
+    ''' minimal asyncio SMTP client, raising smtplib's exceptions '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port=25, timeout=30):
+        (reader, writer) = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout)
+        smtp = cls(reader, writer)
+        (code, message) = await smtp.reply()
+        if code != 220:
+            smtp.close()
+            raise smtplib.SMTPConnectError(code, message)
+        (code, message) = await smtp.command(f'EHLO {socket.gethostname()}')
+        if code != 250:
+            smtp.close()
+            raise smtplib.SMTPHeloError(code, message)
+        return smtp
+
+    async def reply(self):
+        ''' return (code, message) of the next (multi-line) reply '''
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return (int(line[:3]), b'\n'.join(lines))
+
+    async def command(self, line):
+        self.writer.write(line.encode() + b'\r\n')
+        return await self.reply()
+
+    async def sendmail(self, sender, receivers, msg):
+        ''' send a pre-formatted message like smtplib.SMTP.sendmail() '''
+        (code, message) = await self.command(f'MAIL FROM:<{sender}>')
+        if code != 250:
+            await self.command('RSET')
+            raise smtplib.SMTPSenderRefused(code, message, sender)
+        refused = {}
+        for receiver in receivers:
+            (code, message) = await self.command(f'RCPT TO:<{receiver}>')
+            if code not in (250, 251):
+                refused[receiver] = (code, message)
+        if len(refused) == len(receivers):
+            await self.command('RSET')
+            raise smtplib.SMTPRecipientsRefused(refused)
+        (code, message) = await self.command('DATA')
+        if code != 354:
+            await self.command('RSET')
+            raise smtplib.SMTPDataError(code, message)
+        data = re.sub(rb'(?m)^\.', b'..', message_bytes(msg))
+        if not data.endswith(b'\r\n'):
+            data += b'\r\n'
+        self.writer.write(data + b'.\r\n')
+        (code, message) = await self.reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def quit(self):
+        try:
+            await self.command('QUIT')
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncDispatcher(Dispatcher):
+    ''' dispatch queue sending with one asyncio task per connection, call
+        start() in the event loop first '''
+
+    def __init__(self, smtp_host, port=25, connections=4, timeout=30,
+                 **options):
+        super().__init__(**options)
+        self.smtp_host = smtp_host
+        self.port = port
+        self.connections = connections
+        self.timeout = timeout
+        self.pending = 0
+        self._queue = None
+        self._closed = False
+        self._workers = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._done = asyncio.Condition()
+        for item in self._spooled():
+            self._queue.put_nowait(item)
+            self.pending += 1
+        self._workers = [asyncio.create_task(self._run())
+                         for _ in range(self.connections)]
+        return self
+
+    def submit(self, sender, receivers, msg):
+        ''' queue a pre-formatted message (str, bytes or EmailMessage) for
+            sending, return its id '''
+        if self._queue is None:
+            raise RuntimeError('dispatcher is not started')
+        if self._closed:
+            raise RuntimeError('dispatcher is closed')
+        item = self._new_item(sender, receivers, msg)
+        self._queue.put_nowait(item)
+        self.pending += 1
+        return item['id']
+
+    async def _send_batch(self, smtp, batch):
+        results = []
+        try:
+            if smtp is None:
+                smtp = await AsyncSMTP.connect(self.smtp_host, self.port,
+                                               self.timeout)
+            for item in batch:
+                try:
+                    refused = await asyncio.wait_for(smtp.sendmail(
+                        item['sender'], item['receivers'], item['msg']),
+                        self.timeout)
+                    results.append((item, _result(item, refused)))
+                except (smtplib.SMTPResponseException,
+                        smtplib.SMTPRecipientsRefused) as e:
+                    results.append((item, e))
+                except (*DISCONNECTED, asyncio.TimeoutError):
+                    raise
+                except Exception as e:
+                    # e.g. a non-ASCII address: fails for good, but
+                    # mustn't kill the worker
+                    results.append((item, e))
+                    await smtp.command('RSET')
+        except Exception as e:
+            # connecting failed or the session got dropped
+            if smtp is not None:
+                smtp.close()
+                smtp = None
+            results.extend((item, e) for item in batch[len(results):])
+        return (smtp, results)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        smtp = None
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                (smtp, results) = await self._send_batch(smtp, batch)
+                for (item, error) in results:
+                    delay = self._outcome(item, error)
+                    if delay is None:
+                        self.pending -= 1
+                    else:
+                        loop.call_later(delay, self._queue.put_nowait, item)
+                async with self._done:
+                    self._done.notify_all()
+        finally:
+            if smtp is not None:
+                smtp.close()
+
+    async def join(self):
+        ''' wait until all messages are sent or failed '''
+        async with self._done:
+            await self._done.wait_for(lambda: not self.pending)
+
+    async def close(self, timeout=None):
+        ''' wait up to timeout seconds for the queued messages, then stop
+            the workers - unsent messages stay in the spool directory '''
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._closed = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def report(name, latencies, elapsed, dispatcher):
+    count = len(latencies)
+    print(f'{name:>20}: submit mean {sum(latencies) / count * 1e6:6.1f}us '
+          f'p99 {percentile(latencies, 99) * 1e6:6.1f}us, '
+          f'drained {count / elapsed:6.0f} msgs/s '
+          f'({dispatcher.retries} retries, {len(dispatcher.failed)} failed)')
+
+
+def benchmark(count=2000, delay=0.001, connections=4):
+    ''' print submit latency and drain throughput against a fake server
+        taking delay seconds per message and failing every 20th one '''
+    for spool in (False, True):
+        spool_dir = tempfile.mkdtemp() if spool else None
+        options = {'spool_dir': spool_dir, 'backoff': 0.01}
+
+        with FakeSMTPServer(delay=delay, fail_every=20) as server:
+            pool = MailPool(server.host, server.port, size=connections)
+            dispatcher = ThreadDispatcher(pool, **options)
+            latencies = []
+            start = time.perf_counter()
+            for (sender, receivers, msg) in test_messages(count):
+                submitted = time.perf_counter()
+                dispatcher.submit(sender, receivers, msg)
+                latencies.append(time.perf_counter() - submitted)
+            dispatcher.close()
+            report(f'threads spool={spool}', latencies,
+                   time.perf_counter() - start, dispatcher)
+
+        async def run_async():
+            dispatcher = AsyncDispatcher(server.host, server.port,
+                                         connections, **options)
+            await dispatcher.start()
+            latencies = []
+            start = time.perf_counter()
+            for (sender, receivers, msg) in test_messages(count):
+                submitted = time.perf_counter()
+                dispatcher.submit(sender, receivers, msg)
+                latencies.append(time.perf_counter() - submitted)
+            await dispatcher.close()
+            report(f'asyncio spool={spool}', latencies,
+                   time.perf_counter() - start, dispatcher)
+
+        with FakeSMTPServer(delay=delay, fail_every=20) as server:
+            asyncio.run(run_async())
+        if spool_dir:
+            shutil.rmtree(spool_dir)
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark_count, args.delay)
+        return
+
+    spool_dir = args.spool_dir or tempfile.mkdtemp()
+    # Submit while the mail-server is down: the messages stay spooled.
+    with FakeSMTPServer() as server:
+        (host, port) = (server.host, server.port)
+    dispatcher = ThreadDispatcher(MailPool(host, port, size=2),
+                                  spool_dir=spool_dir, backoff=0.1)
+    for (sender, receivers, msg) in test_messages(args.count):
+        dispatcher.submit(sender, receivers, msg)
+    dispatcher.close(timeout=0.5)
+    print(f'server down: {dispatcher.retries} retries, '
+          f'{len(os.listdir(spool_dir)) - 1} messages spooled in {spool_dir}')
+
+    # "Restart": a new dispatcher sends the spooled messages.
+    with FakeSMTPServer(port=port) as server:
+        dispatcher = ThreadDispatcher(MailPool(host, port, size=2),
+                                      spool_dir=spool_dir)
+        dispatcher.close()
+        print(f'server up: sent {dispatcher.sent}, server received '
+              f'{server.messages} messages')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10, help='number of test messages')
+    parser.add_argument('--spool_dir', help='spool directory (default: temporary)')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure submit latency and drain throughput')
+    parser.add_argument('--benchmark_count', type=int, default=2000,
+                        help='number of benchmark messages')
+    parser.add_argument('--delay', type=float, default=0.001,
+                        help='seconds the benchmark server takes per message')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,244 @@
+""" sendmail_stream
+
+Memory-efficient variant of send_mail_with_attachment() of
+sendmail_with_attachments.py: MailServer reads the whole attachment into
+memory and builds the complete EmailMessage, base64 encoded attachment and
+all, before sending it. StreamingMailServer instead
+
+- builds the message with EmailMessage as before, but with small placeholders
+  as attachments, and sends its parts one after the other, the attachments
+  read and base64 encoded in chunks in between, straight into the SMTP DATA
+  command
+- detects the attachments' MIME types (mimetypes module)
+- with an AttachmentCache keeps encoded attachments in files, to send them to
+  many recipients without encoding them again
+
+so memory use is bounded by the chunk size, not the size of the attachments.
+--benchmark compares memory use and time with a local stand-in server of
+fake_smtp.py.
+"""
+import argparse
+import base64
+import email.policy
+import os
+import re
+import smtplib
+import tempfile
+import time
+import tracemalloc
+import uuid
+from email.message import EmailMessage
+
+from fake_smtp import FakeSMTPServer
+from sendmail_with_attachments import MailServer, guess_type
+
+# 57 bytes make one line of 76 base64 characters
+CHUNK_SIZE = 57 * 16 * 1024
+
+
+def encode_base64(fp, chunk_size=CHUNK_SIZE):
+    ''' generator function yielding the base64 encoding of the binary file
+        object fp in chunks of lines of 76 characters ending in CRLF '''
+    if chunk_size % 57:
+        raise ValueError(f'chunk_size {chunk_size} is no multiple of 57')
+    while chunk := fp.read(chunk_size):
+        yield base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+
+
+def read_chunks(filename, chunk_size=CHUNK_SIZE):
+    ''' generator function yielding the content of filename in chunks '''
+    with open(filename, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            yield chunk
+
+
+class AttachmentCache:
+    ''' base64 encoded attachments, kept as files in directory (a temporary
+        one by default) to send them with many messages '''
+
+    def __init__(self, directory=None):
+        self._tmp_dir = None
+        if directory is None:
+            self._tmp_dir = tempfile.TemporaryDirectory()
+            directory = self._tmp_dir.name
+        self.directory = directory
+        # {(path, size, mtime): encoded file}
+        self._files = {}
+        self.hits = 0
+        self.misses = 0
+
+    def encoded(self, filename, chunk_size=CHUNK_SIZE):
+        ''' generator function yielding the base64 encoding of filename in
+            chunks, encoding it only once as long as it doesn't change '''
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        path = self._files.get(key)
+        if path is None:
+            self.misses += 1
+            path = os.path.join(self.directory, f'{len(self._files)}.b64')
+            with open(filename, 'rb') as src, open(path, 'wb') as dst:
+                for chunk in encode_base64(src, chunk_size):
+                    dst.write(chunk)
+            self._files[key] = path
+        else:
+            self.hits += 1
+        yield from read_chunks(path, chunk_size)
+
+    def close(self):
+        if self._tmp_dir:
+            self._tmp_dir.cleanup()
+
+
+def _dot_stuff(data):
+    return re.sub(rb'(?m)^\.', b'..', data)
+
+
+def message_chunks(sender, receivers, subject, payload, filenames,
+                   cache=None, chunk_size=CHUNK_SIZE):
+    ''' generator function yielding the message with the attachments of
+        filenames in chunks, ready to send as SMTP DATA '''
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = sender
+    message['To'] = ','.join(receivers)
+    message.set_content(payload)
+    markers = []
+    for filename in filenames:
+        marker = uuid.uuid4().bytes
+        maintype, subtype = guess_type(filename)
+        message.add_attachment(marker, maintype=maintype, subtype=subtype,
+                               filename=os.path.basename(filename))
+        markers.append(base64.encodebytes(marker).replace(b'\n', b'\r\n'))
+    rest = message.as_bytes(policy=email.policy.SMTP)
+
+    for (filename, marker) in zip(filenames, markers):
+        (part, rest) = rest.split(marker, 1)
+        yield _dot_stuff(part)
+        if cache is None:
+            with open(filename, 'rb') as fp:
+                # base64 lines never start with a dot
+                yield from encode_base64(fp, chunk_size)
+        else:
+            yield from cache.encoded(filename, chunk_size)
+    yield _dot_stuff(rest)
+
+
+class StreamingMailServer(MailServer):
+    ''' MailServer sending attachments in chunks '''
+
+    def __init__(self, smtp_host, cache=None):
+        super().__init__(smtp_host)
+        self.cache = cache
+
+    def send_chunks(self, sender, receivers, chunks):
+        ''' send the message given as iterable of bytes chunks (CRLF line
+            ends, dot-stuffed), return the refused receivers like
+            smtplib.SMTP.sendmail() '''
+        server = self.mailserver
+        server.ehlo_or_helo_if_needed()
+        (code, resp) = server.mail(sender)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, sender)
+        refused = {}
+        for receiver in receivers:
+            (code, resp) = server.rcpt(receiver)
+            if code not in (250, 251):
+                refused[receiver] = (code, resp)
+        if len(refused) == len(receivers):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        (code, resp) = server.docmd('DATA')
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        last = b'\r\n'
+        for chunk in chunks:
+            if chunk:
+                server.sock.sendall(chunk)
+                last = chunk
+        server.sock.sendall(b'.\r\n' if last.endswith(b'\r\n')
+                            else b'\r\n.\r\n')
+        (code, resp) = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def send_mail_with_attachments(self, sender, receivers, subject, payload,
+                                   filenames):
+        ''' send mail with the attachments of filenames, streaming them '''
+        return self.send_chunks(sender, receivers, message_chunks(
+            sender, receivers, subject, payload, filenames, self.cache))
+
+    def send_mail_with_attachment(self, sender, receivers, subject, payload,
+                                  filename):
+        ''' send mail with attachment, streaming it '''
+        return self.send_mail_with_attachments(sender, receivers, subject,
+                                               payload, [filename])
+
+
+def benchmark(size=100, recipients=3):
+    ''' print the peak memory use (of Python objects) and time of sending a
+        size MB attachment to each of recipients '''
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FakeSMTPServer() as server:
+        filename = os.path.join(tmp_dir, 'attachment.bin')
+        with open(filename, 'wb') as fp:
+            for _ in range(size):
+                fp.write(os.urandom(1024 * 1024))
+        smtp_host = f'{server.host}:{server.port}'
+        sender = 'test.test@foo.de'
+
+        cache = AttachmentCache()
+        for (name, mail_server) in [
+                ('EmailMessage', MailServer(smtp_host)),
+                ('streaming', StreamingMailServer(smtp_host)),
+                ('streaming, cached', StreamingMailServer(smtp_host, cache)),
+                ]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            for i in range(recipients):
+                mail_server.send_mail_with_attachment(
+                    sender, [f'you{i}@foo.de'], 'Python-Course attachment',
+                    'This is a test Email.', filename)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{name:>18}: {recipients} x {size} MB in {elapsed:6.2f}s, '
+                  f'peak memory {peak / 1024 / 1024:7.1f} MB')
+            del mail_server
+        cache.close()
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark_size)
+        return
+
+    SMTP_HOST = input("SMTP_HOST: ")
+    domain_name = input("E-MAIL DOMAINNAME: ")
+    filenames = input("ATTACHMENT-FILES: ").split()
+
+    if os.name == 'nt':
+        user = os.environ['USERNAME']
+    elif os.name == 'posix':
+        user = os.environ['USER']
+
+    sender = 'test.test@foo.de'
+    receivers = [f"{user}@{domain_name}"]
+    mail_server = StreamingMailServer(SMTP_HOST)
+    mail_server.send_mail_with_attachments(
+        sender, receivers, 'Python-Course Test SMTP-Email',
+        'This is a test Email.', filenames)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare memory use with sendmail_with_attachments.py')
+    parser.add_argument('--benchmark_size', type=int, default=100,
+                        help='size of the benchmark attachment in MB')
+
+    args = parser.parse_args()
+
+    main(args)
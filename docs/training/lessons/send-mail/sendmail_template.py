@@ -0,0 +1,319 @@
+""" sendmail_template
+
+Personalized mass-mails: instead of formatting every message with a one-off
+f-string as in main() of sendmail.py, a MailTemplate is compiled once from a
+message template with string.Template placeholders ($name or ${name}) and
+then renders one message per recipient - a dict, e.g. a row of a CSV file or
+a line of a JSON lines file.
+
+Recipients are read, rendered and handed to the sender in batches lazily, so
+memory use stays the same for a thousand or a million mails. send_campaign()
+sends with a MailServer (sendmail.py), a MailPool (sendmail_pool.py) or a
+ThreadDispatcher (sendmail_queue.py) and returns the failed messages.
+"""
+import argparse
+import csv
+import itertools
+import json
+import operator
+import os
+import string
+import tempfile
+import time
+import tracemalloc
+
+from fake_smtp import FakeSMTPServer
+from sendmail_pool import MailPool
+
+DEFAULT_TEMPLATE = '''From: From Person $sender
+To: $email
+Subject: Hello from the Python-Course, $name
+
+Dear $name,
+
+currently working on ${topic}? Your course fee of $$${fee} is due.
+'''
+
+
+class MailTemplate:
+    ''' message template compiled to a format string and a getter of the
+        values of its placeholders '''
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = []
+        header_fields = set()
+        parts = []
+        position = 0
+        in_header = True
+        for match in string.Template.pattern.finditer(text):
+            literal = text[position:match.start()]
+            if in_header and ('\n\n' in literal or '\r\n\r\n' in literal):
+                in_header = False
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            position = match.end()
+            if match['escaped'] is not None:
+                parts.append('$')
+                continue
+            name = match['named'] or match['braced']
+            if name is None:
+                raise ValueError(f'Invalid placeholder in template at '
+                                 f'position {match.start()}')
+            if name not in self.fields:
+                self.fields.append(name)
+            index = self.fields.index(name)
+            if in_header:
+                header_fields.add(index)
+            parts.append(f'{{{index}}}')
+        parts.append(text[position:].replace('{', '{{').replace('}', '}}'))
+        self._format = ''.join(parts).format
+        self._header_fields = sorted(header_fields)
+        if len(self.fields) == 1:
+            getter = operator.itemgetter(self.fields[0])
+            self._values = lambda recipient: (getter(recipient),)
+        elif self.fields:
+            self._values = operator.itemgetter(*self.fields)
+        else:
+            self._values = lambda recipient: ()
+
+    def render(self, recipient):
+        ''' return the message for the recipient dict, raise ValueError if
+            it lacks a value for a placeholder '''
+        try:
+            values = self._values(recipient)
+        except KeyError as e:
+            raise ValueError(f'Missing field {e}') from None
+        if None in values:
+            # e.g. a short CSV row
+            raise ValueError(f'Missing value of field '
+                             f'{self.fields[values.index(None)]!r}')
+        for index in self._header_fields:
+            value = str(values[index])
+            if '\n' in value or '\r' in value:
+                # Don't let values inject header lines.
+                raise ValueError(f'Line break in header field '
+                                 f'{self.fields[index]!r}: {value!r}')
+        return self._format(*values)
+
+
+def read_recipients(filename):
+    ''' generator function yielding the recipients of a CSV (with header
+        row) or JSON lines (*.jsonl) file as dicts '''
+    with open(filename, newline='', encoding='utf-8') as fp:
+        if filename.endswith('.jsonl'):
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(fp)
+
+
+def render_messages(template, recipients, sender, to_field='email'):
+    ''' generator function yielding a (sender, receivers, msg) tuple for
+        every recipient, or the ValueError if it can't be rendered '''
+    for recipient in recipients:
+        recipient = {'sender': sender, **recipient}
+        try:
+            receiver = recipient[to_field]
+            if receiver is None:
+                raise KeyError(to_field)
+            message = (sender, [receiver], template.render(recipient))
+        except KeyError as e:
+            message = ValueError(f'Missing field {e}')
+        except ValueError as e:
+            message = e
+        yield message
+
+
+def batched(iterable, size):
+    ''' generator function yielding lists of up to size items of iterable '''
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def send_campaign(mail_server, template, recipients, sender,
+                  to_field='email', batch_size=1000, max_pending=None):
+    ''' render and send a message per recipient, batch_size at a time,
+        return (number of messages, {index: exception} of the failed ones)
+
+        Recipients that can't be rendered (see MailTemplate.render()) fail
+        with their ValueError, without stopping the campaign.
+
+        A ThreadDispatcher gets at most max_pending (default 10 batches)
+        messages queued at a time: once as many are pending send_campaign()
+        waits for them to be sent or failed. '''
+    if max_pending is None:
+        max_pending = 10 * batch_size
+    count = 0
+    failures = {}
+    # {id: index} of the messages queued since the dispatcher's last join()
+    submitted = {}
+    seen = len(getattr(mail_server, 'failed', ()))
+
+    def join():
+        nonlocal seen
+        mail_server.join()
+        for (item, error) in mail_server.failed[seen:]:
+            if item['id'] in submitted:
+                failures[submitted[item['id']]] = error
+        seen = len(mail_server.failed)
+        submitted.clear()
+
+    for batch in batched(render_messages(template, recipients, sender,
+                                         to_field), batch_size):
+        # (index, message) of the rendered messages
+        rendered = []
+        for (index, message) in enumerate(batch, count):
+            if isinstance(message, Exception):
+                failures[index] = message
+            else:
+                rendered.append((index, message))
+        if hasattr(mail_server, 'send_many'):
+            # MailPool
+            errors = mail_server.send_many(message for (_, message)
+                                           in rendered)
+            for (position, error) in errors.items():
+                failures[rendered[position][0]] = error
+        elif hasattr(mail_server, 'submit'):
+            # dispatcher
+            for (index, message) in rendered:
+                submitted[mail_server.submit(*message)] = index
+            if len(submitted) >= max_pending:
+                join()
+        else:
+            # MailServer
+            for (index, message) in rendered:
+                try:
+                    mail_server.send_mail(*message)
+                except Exception as e:
+                    failures[index] = e
+        count += len(batch)
+    if submitted:
+        join()
+    return (count, failures)
+
+
+def sample_recipients(count):
+    for i in range(count):
+        yield {'email': f'student{i}@foo.de', 'name': f'Student {i}',
+               'topic': 'decorators', 'fee': f'{i % 500}.00'}
+
+
+def write_recipients(filename, recipients):
+    ''' write recipients as CSV file or JSON lines (*.jsonl) file '''
+    with open(filename, 'w', newline='', encoding='utf-8') as fp:
+        if filename.endswith('.jsonl'):
+            for recipient in recipients:
+                fp.write(json.dumps(recipient) + '\n')
+        else:
+            writer = None
+            for recipient in recipients:
+                if writer is None:
+                    writer = csv.DictWriter(fp, fieldnames=list(recipient))
+                    writer.writeheader()
+                writer.writerow(recipient)
+
+
+class CountingSender:
+    ''' stand-in for a MailServer, counting the messages '''
+
+    def __init__(self):
+        self.count = 0
+
+    def send_mail(self, sender, receivers, msg):
+        self.count += 1
+
+
+def benchmark(count=200_000):
+    ''' print rendering throughput of string.Template and MailTemplate, and
+        the throughput and peak memory of campaigns from recipient files '''
+    sender = 'test.test@foo.de'
+    recipients = [{'sender': sender, **recipient}
+                  for recipient in sample_recipients(count)]
+    template = MailTemplate(DEFAULT_TEMPLATE)
+    for (name, render) in [
+            ('string.Template per message',
+             lambda recipient: string.Template(DEFAULT_TEMPLATE).substitute(
+                 recipient)),
+            ('string.Template',
+             string.Template(DEFAULT_TEMPLATE).substitute),
+            ('MailTemplate', template.render),
+            ]:
+        start = time.perf_counter()
+        for recipient in recipients:
+            render(recipient)
+        elapsed = time.perf_counter() - start
+        print(f'{name:>28}: {count / elapsed:10.0f} msgs/s')
+    del recipients
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for extension in ('csv', 'jsonl'):
+            filename = os.path.join(tmp_dir, f'recipients.{extension}')
+            write_recipients(filename, sample_recipients(count))
+            counter = CountingSender()
+            start = time.perf_counter()
+            send_campaign(counter, template, read_recipients(filename),
+                          sender)
+            elapsed = time.perf_counter() - start
+            # once more, tracing memory allocations (which takes longer)
+            tracemalloc.start()
+            send_campaign(CountingSender(), template,
+                          read_recipients(filename), sender)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{extension:>5} campaign of {counter.count} mails: '
+                  f'{counter.count / elapsed:10.0f} msgs/s, '
+                  f'peak memory {peak / 1024 / 1024:.1f} MB')
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.benchmark_count)
+        return
+
+    if args.template:
+        with open(args.template, encoding='utf-8') as fp:
+            template = MailTemplate(fp.read())
+    else:
+        template = MailTemplate(DEFAULT_TEMPLATE)
+    if args.recipients:
+        recipients = read_recipients(args.recipients)
+    else:
+        recipients = sample_recipients(args.count)
+    sender = 'test.test@foo.de'
+
+    if args.fake:
+        server = FakeSMTPServer().start()
+        (SMTP_HOST, port) = (server.host, server.port)
+    else:
+        SMTP_HOST = input("SMTP_HOST: ")
+        port = 0
+
+    with MailPool(SMTP_HOST, port, size=args.pool_size) as pool:
+        (count, failures) = send_campaign(pool, template, recipients, sender)
+    print(f'sent {count - len(failures)} of {count} messages')
+    for (index, error) in sorted(failures.items()):
+        print(f'ERROR: message {index}: {error}')
+    if args.fake:
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--template', help='message template file')
+    parser.add_argument('--recipients', help='CSV or JSON lines (*.jsonl) file')
+    parser.add_argument('--count', type=int, default=10,
+                        help='number of sample recipients without --recipients')
+    parser.add_argument('--pool_size', type=int, default=4,
+                        help='number of connections')
+    parser.add_argument('--fake', action='store_true',
+                        help='send to a local stand-in server')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure rendering throughput and memory use')
+    parser.add_argument('--benchmark_count', type=int, default=200_000,
+                        help='number of benchmark recipients')
+
+    args = parser.parse_args()
+
+    main(args)
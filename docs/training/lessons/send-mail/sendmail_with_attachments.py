@@ -1,9 +1,19 @@
 
 from email.message import EmailMessage
+import mimetypes
 import os
 import smtplib, sys, time
 
 
+def guess_type(filename):
+    ''' return (maintype, subtype) of the MIME type of filename '''
+    ctype, encoding = mimetypes.guess_type(filename)
+    if ctype is None or encoding is not None:
+        # unknown or compressed file
+        ctype = 'application/octet-stream'
+    return tuple(ctype.split('/', 1))
+
+
 class MailServer:
     def __init__(self, smtp_host):
         self.mail_server_name = smtp_host
@@ -29,8 +39,9 @@ class MailServer:
         email['To'] = ','.join(receivers)
         email.set_content(payload)
         with open(filename, 'rb') as fp:
-            img_data = fp.read()
-        email.add_attachment(img_data, maintype='image', subtype='png',
+            data = fp.read()
+        maintype, subtype = guess_type(filename)
+        email.add_attachment(data, maintype=maintype, subtype=subtype,
             filename=os.path.basename(filename))
  
         self.mailserver.send_message(email)
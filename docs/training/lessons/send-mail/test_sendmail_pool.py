@@ -0,0 +1,85 @@
+""" test_sendmail_pool
+
+Tests of sendmail_pool.py against the local stand-in server of fake_smtp.py,
+run with: python -m pytest
+"""
+import sendmail_pool
+from fake_smtp import FakeSMTPServer
+from sendmail_pool import MailPool
+
+
+def messages(count):
+    return sendmail_pool.test_messages(count)
+
+
+def test_reconnect_after_dropped_session():
+    ''' a message failing on a dropped session is sent again on a new
+        connection, without delivering it twice '''
+    with FakeSMTPServer(drop_after=2) as server:
+        # no NOOP check: the dropped session shows up when sending
+        with MailPool(server.host, server.port, size=1,
+                      check_after=3600) as pool:
+            for (sender, receivers, msg) in messages(5):
+                assert pool.send_mail(sender, receivers, msg) == {}
+        assert server.messages == 5
+        assert pool.reconnects == 2
+        assert pool.connects == 3
+
+
+def test_retries_exhausted():
+    ''' with retries=0 the dropped session's error is raised '''
+    with FakeSMTPServer(drop_after=1) as server:
+        with MailPool(server.host, server.port, size=1, check_after=3600,
+                      retries=0) as pool:
+            ((sender, receivers, msg), second) = messages(2)
+            pool.send_mail(sender, receivers, msg)
+            try:
+                pool.send_mail(*second)
+            except sendmail_pool.DISCONNECTED:
+                pass
+            else:
+                raise AssertionError('send_mail() did not raise')
+        assert server.messages == 1
+
+
+def test_noop_health_check():
+    ''' idle connections are checked with NOOP and replaced when dropped '''
+    with FakeSMTPServer(drop_after=1) as server:
+        with MailPool(server.host, server.port, size=1,
+                      check_after=0) as pool:
+            for (sender, receivers, msg) in messages(3):
+                pool.send_mail(sender, receivers, msg)
+            # The NOOP check found every dropped session, so no message
+            # needed a retry.
+            assert pool.reconnects == 2
+            assert pool.connects == 3
+        assert server.messages == 3
+
+        with MailPool(server.host, server.port) as pool:
+            connection = pool.acquire()
+            assert pool.is_healthy(connection)
+            connection.sendmail(*next(messages(1)))
+            # dropped by the server after its message
+            assert not pool.is_healthy(connection)
+            pool.release(connection, broken=True)
+
+
+def test_send_many_spreads_over_connections():
+    ''' send_many() sends over all connections of the pool '''
+    with FakeSMTPServer(delay=0.01) as server:
+        with MailPool(server.host, server.port, size=4) as pool:
+            failures = pool.send_many(messages(40))
+        assert failures == {}
+        assert server.messages == 40
+        assert pool.connects == server.connections == 4
+
+
+def test_send_many_failures():
+    ''' send_many() returns the failed messages by index '''
+    with FakeSMTPServer() as server:
+        (host, port) = (server.host, server.port)
+    # server down
+    with MailPool(host, port, size=2, timeout=1) as pool:
+        failures = pool.send_many(messages(3))
+    assert sorted(failures) == [0, 1, 2]
+    assert all(isinstance(e, OSError) for e in failures.values())
@@ -0,0 +1,226 @@
+""" test_sendmail_queue
+
+Tests of sendmail_queue.py against the local stand-in server of fake_smtp.py,
+run with: python -m pytest
+"""
+import asyncio
+import os
+import smtplib
+import time
+
+import pytest
+
+import sendmail_pool
+from fake_smtp import FakeSMTPServer
+from sendmail_pool import MailPool
+from sendmail_queue import AsyncDispatcher, Dispatcher, ThreadDispatcher
+
+
+def messages(count):
+    return sendmail_pool.test_messages(count)
+
+
+def spooled(spool_dir):
+    return sorted(name for name in os.listdir(spool_dir)
+                  if name.endswith('.json'))
+
+
+def down_server_address():
+    ''' return (host, port) of a server that just stopped '''
+    with FakeSMTPServer() as server:
+        return (server.host, server.port)
+
+
+def test_thread_latency_and_throughput(tmp_path):
+    ''' submit() doesn't wait for the server, the workers drain the queue
+        over all connections '''
+    (count, delay) = (200, 0.005)
+    with FakeSMTPServer(delay=delay) as server:
+        dispatcher = ThreadDispatcher(MailPool(server.host, server.port, 4),
+                                      spool_dir=tmp_path, batch_size=10)
+        latencies = []
+        start = time.perf_counter()
+        for (sender, receivers, msg) in messages(count):
+            submitted = time.perf_counter()
+            dispatcher.submit(sender, receivers, msg)
+            latencies.append(time.perf_counter() - submitted)
+        assert dispatcher.join(timeout=30)
+        elapsed = time.perf_counter() - start
+        dispatcher.close()
+        assert server.messages == dispatcher.sent == count
+    # a fraction of the server's time per message, even with spooling
+    assert sum(latencies) / count < delay / 2
+    # 4 connections: faster than one message at a time
+    assert count / elapsed > 1.5 / delay
+    assert spooled(tmp_path) == []
+
+
+def test_async_latency_and_throughput(tmp_path):
+    (count, delay) = (200, 0.005)
+
+    async def run(server):
+        dispatcher = await AsyncDispatcher(
+            server.host, server.port, connections=4, spool_dir=tmp_path,
+            batch_size=10).start()
+        latencies = []
+        start = time.perf_counter()
+        for (sender, receivers, msg) in messages(count):
+            submitted = time.perf_counter()
+            dispatcher.submit(sender, receivers, msg)
+            latencies.append(time.perf_counter() - submitted)
+        await asyncio.wait_for(dispatcher.join(), 30)
+        elapsed = time.perf_counter() - start
+        await dispatcher.close()
+        return (dispatcher, latencies, elapsed)
+
+    with FakeSMTPServer(delay=delay) as server:
+        (dispatcher, latencies, elapsed) = asyncio.run(run(server))
+        assert server.messages == dispatcher.sent == count
+    assert sum(latencies) / count < delay / 2
+    assert count / elapsed > 1.5 / delay
+    assert spooled(tmp_path) == []
+
+
+def test_backoff():
+    ''' the retry delay doubles per attempt, with jitter, up to max_backoff '''
+    dispatcher = Dispatcher(backoff=0.1, max_backoff=0.5, max_attempts=10)
+    item = {'attempts': 0}
+    error = smtplib.SMTPResponseException(451, b'Try again later')
+    for maximum in (0.1, 0.2, 0.4, 0.5, 0.5):
+        delay = dispatcher._outcome(item, error)
+        assert maximum / 2 <= delay <= maximum
+    assert dispatcher.retries == 5
+
+    # permanent failures aren't retried
+    error = smtplib.SMTPResponseException(550, b'No such user')
+    assert dispatcher._outcome({'attempts': 0}, error) is None
+    assert len(dispatcher.failed) == 1
+
+
+def test_thread_retry(tmp_path):
+    ''' messages rejected with 451 are sent when retried '''
+    with FakeSMTPServer(fail_every=3) as server:
+        dispatcher = ThreadDispatcher(MailPool(server.host, server.port, 2),
+                                      spool_dir=tmp_path, backoff=0.01)
+        for (sender, receivers, msg) in messages(30):
+            dispatcher.submit(sender, receivers, msg)
+        dispatcher.close()
+        assert dispatcher.sent == server.messages == 30
+        assert dispatcher.retries >= 10
+        assert dispatcher.failed == []
+    assert spooled(tmp_path) == []
+
+
+def test_async_retry(tmp_path):
+    async def run(server):
+        dispatcher = await AsyncDispatcher(
+            server.host, server.port, connections=2, spool_dir=tmp_path,
+            backoff=0.01).start()
+        for (sender, receivers, msg) in messages(30):
+            dispatcher.submit(sender, receivers, msg)
+        await dispatcher.close(timeout=30)
+        return dispatcher
+
+    with FakeSMTPServer(fail_every=3) as server:
+        dispatcher = asyncio.run(run(server))
+        assert dispatcher.sent == server.messages == 30
+        assert dispatcher.retries >= 10
+        assert dispatcher.failed == []
+    assert spooled(tmp_path) == []
+
+
+def test_give_up_after_max_attempts(tmp_path):
+    ''' messages still failing after max_attempts go to the failed spool '''
+    (host, port) = down_server_address()
+    dispatcher = ThreadDispatcher(MailPool(host, port, 1, timeout=1),
+                                  spool_dir=tmp_path, backoff=0.01,
+                                  max_attempts=3)
+    dispatcher.submit('me@foo.de', ['you@foo.de'], 'Subject: x\n\nx')
+    dispatcher.close(timeout=10)
+    assert dispatcher.retries == 2
+    assert len(dispatcher.failed) == 1
+    assert spooled(tmp_path) == []
+    (item, error) = dispatcher.failed[0]
+    assert isinstance(error, OSError)
+    assert spooled(tmp_path / 'failed') == [f"{item['id']}.json"]
+
+
+def test_thread_restore_spooled(tmp_path):
+    ''' messages spooled while the server is down are sent after a restart '''
+    (host, port) = down_server_address()
+    dispatcher = ThreadDispatcher(MailPool(host, port, 2, timeout=1),
+                                  spool_dir=tmp_path, backoff=10)
+    ids = [dispatcher.submit(sender, receivers, msg)
+           for (sender, receivers, msg) in messages(10)]
+    dispatcher.close(timeout=0.5)
+    assert dispatcher.sent == 0
+    assert spooled(tmp_path) == sorted(f'{id}.json' for id in ids)
+
+    with FakeSMTPServer(port=port, keep=True) as server:
+        dispatcher = ThreadDispatcher(MailPool(host, port, 2),
+                                      spool_dir=tmp_path)
+        dispatcher.close()
+        assert dispatcher.sent == server.messages == 10
+    assert spooled(tmp_path) == []
+    subjects = sorted(line for msg in server.received
+                      for line in msg.splitlines() if line.startswith(b'Subj'))
+    assert len(set(subjects)) == 10
+
+
+def test_async_restore_spooled(tmp_path):
+    (host, port) = down_server_address()
+
+    async def run(count):
+        dispatcher = await AsyncDispatcher(host, port, connections=2,
+                                           timeout=1, spool_dir=tmp_path,
+                                           backoff=10).start()
+        for (sender, receivers, msg) in messages(count):
+            dispatcher.submit(sender, receivers, msg)
+        await dispatcher.close(timeout=0.5 if count else 30)
+        return dispatcher
+
+    dispatcher = asyncio.run(run(10))
+    assert dispatcher.sent == 0
+    assert len(spooled(tmp_path)) == 10
+
+    with FakeSMTPServer(port=port) as server:
+        dispatcher = asyncio.run(run(0))
+        assert dispatcher.sent == server.messages == 10
+    assert spooled(tmp_path) == []
+
+
+def test_non_ascii_message(tmp_path):
+    ''' str messages are sent UTF-8 encoded, bytes unchanged '''
+    with FakeSMTPServer(keep=True) as server:
+        dispatcher = ThreadDispatcher(MailPool(server.host, server.port, 1),
+                                      spool_dir=tmp_path)
+        dispatcher.submit('me@foo.de', ['you@foo.de'],
+                          'Subject: Grüße\n\nÄpfel')
+        dispatcher.submit('me@foo.de', ['you@foo.de'],
+                          b'Subject: raw\r\n\r\n\xff\xfe')
+        dispatcher.close()
+        assert dispatcher.failed == []
+    assert server.received == [
+        'Subject: Grüße\r\n\r\nÄpfel\r\n'.encode(),
+        b'Subject: raw\r\n\r\n\xff\xfe\r\n']
+
+
+def test_submit_after_close(tmp_path):
+    ''' a rejected message isn't left in the spool directory '''
+    with FakeSMTPServer() as server:
+        dispatcher = ThreadDispatcher(MailPool(server.host, server.port, 1),
+                                      spool_dir=tmp_path)
+        dispatcher.close()
+        with pytest.raises(RuntimeError):
+            dispatcher.submit('me@foo.de', ['you@foo.de'], 'Subject: x\n\nx')
+
+        async def run():
+            dispatcher = await AsyncDispatcher(server.host, server.port,
+                                               spool_dir=tmp_path).start()
+            await dispatcher.close()
+            with pytest.raises(RuntimeError):
+                dispatcher.submit('me@foo.de', ['you@foo.de'],
+                                  'Subject: x\n\nx')
+
+        asyncio.run(run())
+    assert spooled(tmp_path) == []